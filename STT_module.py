@@ -1,47 +1,992 @@
 from datetime import timedelta
-from webvtt import WebVTT, Caption
-from faster_whisper import WhisperModel
+from webvtt import Caption
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from faster_whisper.audio import decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+import av
+import ctranslate2
+import json
+import multiprocessing
+import numpy as np
 import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+from cache_store import DEFAULT_CACHE_DIR, DiskCache, file_fingerprint, make_key
+from logger import logger
 
+# Resident model budget of the process-wide pool, override with $YOUTUBESCRIPT_WHISPER_POOL_BYTES
+DEFAULT_POOL_MAX_BYTES = int(
+    os.environ.get("YOUTUBESCRIPT_WHISPER_POOL_BYTES", 6 * 1024**3)
+)
+# Parameter counts of the released checkpoints, used to estimate resident memory
+WHISPER_PARAMETERS = {
+    "tiny": 39e6,
+    "base": 74e6,
+    "small": 244e6,
+    "medium": 769e6,
+    "large": 1550e6,
+    "turbo": 809e6,
+    "distil-small": 166e6,
+    "distil-medium": 394e6,
+    "distil-large": 756e6,
+}
+BYTES_PER_PARAMETER = {
+    "float32": 4,
+    "float16": 2,
+    "bfloat16": 2,
+    "int8_float32": 1,
+    "int8_float16": 1,
+    "int8_bfloat16": 1,
+    "int8": 1,
+    "int16": 2,
+}
 
-def audio_language(audio_path):
+
+def estimate_model_bytes(size, compute_type):
+    """
+    Estimates the resident memory of a Whisper model.
+
+    Args:
+        size (str): A model size such as "medium" or "large-v3", or a model directory.
+        compute_type (str): The CTranslate2 compute type.
+
+    Returns:
+        int: The estimated size in bytes.
+    """
+    if os.path.isdir(size):
+        return sum(
+            os.path.getsize(os.path.join(size, name))
+            for name in os.listdir(size)
+            if os.path.isfile(os.path.join(size, name))
+        )
+    # Names such as "large-v3-turbo" or "faster-distil-whisper-large-v3" carry the
+    # variant anywhere, so it is looked for before the plain size
+    name = size.split("/")[-1].lower()
+    base = next(
+        (base for base in ("tiny", "base", "small", "medium", "large") if base in name),
+        "large",
+    )
+    if "turbo" in name:
+        key = "turbo"
+    elif "distil" in name and f"distil-{base}" in WHISPER_PARAMETERS:
+        key = f"distil-{base}"
+    else:
+        key = base
+    return int(WHISPER_PARAMETERS[key] * BYTES_PER_PARAMETER.get(compute_type, 2))
+
+
+class WhisperModelPool:
+    """
+    A thread-safe pool of loaded WhisperModels, keyed by (size, device, compute_type).
+
+    Models stay resident between calls, so a playlist loads each model once instead of
+    once per video. When the estimated memory of the resident models exceeds
+    `max_bytes`, the least recently used ones are dropped; the model just requested is
+    always kept. Hits, misses and evictions are counted for monitoring.
+
+    Args:
+        max_bytes (int, optional): The memory budget for resident models. Defaults to
+            $YOUTUBESCRIPT_WHISPER_POOL_BYTES or 6 GiB.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_POOL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._models = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, size, device="cuda", compute_type="float16", **options):
+        """
+        Returns a loaded model, loading it on first use.
+
+        Args:
+            size (str): The model size or path, as for WhisperModel.
+            device (str, optional): "cuda", "cpu" or "auto". Defaults to "cuda".
+            compute_type (str, optional): The CTranslate2 compute type. Defaults to "float16".
+            **options: Passed on to WhisperModel (cpu_threads, num_workers, ...); they only
+                apply when the model is loaded.
+
+        Returns:
+            WhisperModel: The shared model.
+        """
+        key = (size, device, compute_type)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Load outside the pool lock, so other models stay available meanwhile
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    return self._models[key][0]
+                self.misses += 1
+            logger.info(f"loading whisper model {size} ({device}, {compute_type})")
+            model = WhisperModel(size, device=device, compute_type=compute_type, **options)
+            with self._lock:
+                self._models[key] = (model, estimate_model_bytes(size, compute_type))
+                self._evict()
+                self._load_locks.pop(key, None)
+        return model
+
+    def _evict(self):
+        total = sum(model_bytes for _, model_bytes in self._models.values())
+        while total > self.max_bytes and len(self._models) > 1:
+            key, (_, model_bytes) = self._models.popitem(last=False)
+            total -= model_bytes
+            self.evictions += 1
+            logger.info(f"whisper model pool evicted {key}")
+
+    def resize(self, max_bytes):
+        """Changes the memory budget, evicting models if they no longer fit."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """Drops every resident model."""
+        with self._lock:
+            self._models.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, evictions, the resident keys (least recently used first)
+                and their estimated bytes.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "resident": list(self._models),
+                "bytes": sum(model_bytes for _, model_bytes in self._models.values()),
+            }
+
+
+model_pool = WhisperModelPool()
+
+# Compute types in order of preference per device; the first supported one is the default
+PROFILE_COMPUTE_TYPES = {
+    "cuda": ("float16", "int8_float16", "float32"),
+    "cpu": ("int8", "int8_float32", "float32"),
+}
+# Fastest measured profile per machine and model size, see benchmark_stt_profiles
+STT_PROFILE_FILE = os.path.join(DEFAULT_CACHE_DIR, "stt_profiles.json")
+SAMPLE_RATE = 16000
+# Start and length in seconds of the audio window used for language detection
+LANGUAGE_WINDOW = (60.0, 30.0)
+# Seconds between fsyncs of a VTT file that is being transcribed
+VTT_FSYNC_INTERVAL = 5.0
+# Parallel transcription never cuts the audio into pieces shorter than this
+MIN_PIECE_SECONDS = 120.0
+# Pauses at least this long count as split points between pieces
+SPLIT_SILENCE_MS = 500
+
+# Finished transcripts by audio content, about 1 MB per 10 hours of speech
+TRANSCRIPT_CACHE_MAX_BYTES = 256 * 1024**2
+transcript_cache = DiskCache("stt_transcripts", TRANSCRIPT_CACHE_MAX_BYTES)
+_profile_lock = threading.Lock()
+
+
+def _available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def detect_device():
+    """Returns "cuda" when CTranslate2 sees a CUDA device, "cpu" otherwise."""
+    return "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+
+
+def _supported_compute_types(device):
+    try:
+        return set(ctranslate2.get_supported_compute_types(device))
+    except (RuntimeError, ValueError):
+        return set()
+
+
+def _machine_key(device, model_size):
+    return "|".join(
+        str(part)
+        for part in (
+            platform.node(),
+            platform.machine(),
+            _available_cores(),
+            ctranslate2.get_cuda_device_count(),
+            ctranslate2.__version__,
+            device,
+            model_size,
+        )
+    )
+
+
+def _read_profiles():
+    try:
+        with open(STT_PROFILE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def resolve_stt_profile(
+    model_size=None, device=None, compute_type=None, cpu_threads=None, num_workers=None
+):
+    """
+    Picks the device, compute type and threading for Whisper on this machine.
+
+    Every setting can be overridden by the argument, then by an environment variable
+    ($YOUTUBESCRIPT_STT_DEVICE, _COMPUTE_TYPE, _CPU_THREADS, _NUM_WORKERS). Otherwise the
+    device is CUDA when available and CPU elsewhere; the compute type is the fastest one
+    measured by `benchmark_stt_profiles` for this machine and model size, or the first
+    supported of float16 (CUDA) or int8 / int8_float32 (CPU). On CPU the available cores
+    are shared between the workers through cpu_threads.
+
+    Args:
+        model_size (str, optional): The model the profile is for, to use its benchmark.
+
+    Returns:
+        dict: device, compute_type, cpu_threads and num_workers.
+    """
+    device = device or os.environ.get("YOUTUBESCRIPT_STT_DEVICE") or detect_device()
+    measured = _read_profiles().get(_machine_key(device, model_size), {})
+    supported = _supported_compute_types(device)
+    compute_type = (
+        compute_type
+        or os.environ.get("YOUTUBESCRIPT_STT_COMPUTE_TYPE")
+        or measured.get("compute_type")
+        or next(
+            (c for c in PROFILE_COMPUTE_TYPES.get(device, ()) if c in supported),
+            "default",
+        )
+    )
+    num_workers = num_workers or _env_int("YOUTUBESCRIPT_STT_NUM_WORKERS") or 1
+    cpu_threads = cpu_threads or _env_int("YOUTUBESCRIPT_STT_CPU_THREADS")
+    if cpu_threads is None:
+        cpu_threads = max(1, _available_cores() // num_workers) if device == "cpu" else 0
+    return {
+        "device": device,
+        "compute_type": compute_type,
+        "cpu_threads": cpu_threads,
+        "num_workers": num_workers,
+    }
+
+
+def get_whisper_model(model_size, profile=None):
+    """Returns the pooled model for a size with the given or resolved execution profile."""
+    profile = profile or resolve_stt_profile(model_size)
+    return model_pool.get(
+        model_size,
+        device=profile["device"],
+        compute_type=profile["compute_type"],
+        cpu_threads=profile["cpu_threads"],
+        num_workers=profile["num_workers"],
+    )
+
+
+def _reference_clip(seconds=30):
+    """A synthetic, speech-like clip: noise with syllable-rate bursts of harmonics."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    envelope = (np.sin(2 * np.pi * 4 * t) > 0).astype(np.float32)
+    voice = sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((140, 280, 420, 560), 1))
+    return (0.3 * envelope * voice + 0.01 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def benchmark_stt_profiles(audio=None, model_size="base", device=None, compute_types=None):
+    """
+    Times Whisper with every supported compute type and caches the fastest for this machine.
+
+    The models are loaded outside the pool and dropped afterwards. The result is stored
+    in STT_PROFILE_FILE and picked up by `resolve_stt_profile` for the same model size.
+
+    Args:
+        audio (str or numpy.ndarray, optional): A reference clip, ideally 30-60 seconds of
+            speech. Defaults to a synthetic 30 second clip.
+        model_size (str, optional): The model to time. Defaults to "base".
+        device (str, optional): Defaults to the detected device.
+        compute_types (tuple, optional): Defaults to the supported ones of the device.
+
+    Returns:
+        list: One dict per compute type with compute_type, load_seconds, seconds and rtf
+            (real-time factor), fastest first.
+    """
+    device = device or detect_device()
+    if audio is None:
+        audio = _reference_clip()
+    elif isinstance(audio, str):
+        audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+    duration = len(audio) / SAMPLE_RATE
+    supported = _supported_compute_types(device)
+    compute_types = compute_types or [
+        c for c in PROFILE_COMPUTE_TYPES.get(device, ()) if c in supported
+    ]
+
+    report = []
+    for compute_type in compute_types:
+        profile = resolve_stt_profile(None, device, compute_type)
+        start = time.perf_counter()
+        model = WhisperModel(
+            model_size,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=profile["cpu_threads"],
+            num_workers=profile["num_workers"],
+        )
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        segments, _ = model.transcribe(audio, beam_size=5)
+        for _ in segments:
+            pass
+        seconds = time.perf_counter() - start
+        del model
+        report.append(
+            {
+                "compute_type": compute_type,
+                "load_seconds": load_seconds,
+                "seconds": seconds,
+                "rtf": seconds / duration,
+            }
+        )
+        logger.info(f"stt profile {device}/{compute_type}: rtf {seconds / duration:.3f}")
+    report.sort(key=lambda row: row["seconds"])
+
+    if report:
+        with _profile_lock:
+            profiles = _read_profiles()
+            profiles[_machine_key(device, model_size)] = {
+                "compute_type": report[0]["compute_type"],
+                "rtf": report[0]["rtf"],
+            }
+            os.makedirs(os.path.dirname(STT_PROFILE_FILE), exist_ok=True)
+            tmp_file = f"{STT_PROFILE_FILE}.{os.getpid()}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(profiles, f, indent=2)
+            os.replace(tmp_file, STT_PROFILE_FILE)
+    return report
+
+
+def decode_window(audio_path, start, seconds):
+    """
+    Decodes a window of an audio or video file, seeking instead of decoding from the start.
+
+    Args:
+        audio_path (str): The media file.
+        start (float): The window start in seconds; a window past the end of the file
+            is moved back to its last `seconds`.
+        seconds (float): The window length in seconds.
+
+    Returns:
+        numpy.ndarray: 16 kHz mono float32 samples.
+    """
+    needed = int(seconds * SAMPLE_RATE)
+    with av.open(audio_path) as container:
+        stream = container.streams.audio[0]
+        if container.duration is not None:
+            start = max(0.0, min(start, container.duration / av.time_base - seconds))
+        if start > 0:
+            container.seek(int(start * av.time_base))
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+        chunks = []
+        collected = 0
+        for frame in container.decode(stream):
+            # Seeking lands on the packet before the window
+            frame_end = (frame.time or 0.0) + frame.samples / frame.sample_rate
+            if frame_end < start:
+                continue
+            for resampled in resampler.resample(frame):
+                chunk = resampled.to_ndarray().reshape(-1)
+                chunks.append(chunk)
+                collected += len(chunk)
+            if collected >= needed:
+                break
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks)[:needed].astype(np.float32) / 32768.0
+
+
+def audio_language(audio_path, profile=None, model_size="base", window=LANGUAGE_WINDOW):
+    """
+    Detects the spoken language of an audio file with Whisper's language detection alone.
+
+    Only a window of the file is decoded and no text is generated. The model comes from
+    the pool, so passing the size used for transcription loads no extra model.
+
+    Args:
+        audio_path (str): The audio or video file.
+        profile (dict, optional): The execution profile, see `resolve_stt_profile`.
+        model_size (str, optional): The Whisper model. Defaults to "base".
+        window (tuple, optional): Start and length in seconds of the audio listened to.
+            Defaults to 30 seconds from the first minute on.
+
+    Returns:
+        str: The language code, e.g. "en".
+    """
     os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
 
-    # Run on GPU with FP16
-    model = WhisperModel("base", device="cuda", compute_type="float16")
+    # GPU with FP16 when available, int8 on CPU, see resolve_stt_profile
+    model = get_whisper_model(model_size, profile)
+    audio = decode_window(audio_path, *window)
+    language, probability, _ = model.detect_language(audio=audio)
+    logger.info(f"detected language {language} ({probability:.2f}) in {audio_path}")
+    return language
+
+
+def _caption(start, end, text):
+    """Builds a caption from segment times in seconds, with millisecond timestamps."""
+    start_time = str(timedelta(seconds=start))
+    end_time = str(timedelta(seconds=end))
 
-    segments, info = model.transcribe(audio_path, beam_size=5)
-    return info.language
+    # Ensure the timestamps have millisecond precision
+    if "." not in start_time:
+        start_time += ".000"
+    if "." not in end_time:
+        end_time += ".000"
+    return Caption(start=start_time, end=end_time, text=text)
 
 
-def faster_whisper_transcribe_vtt(audio_path, model_size, output_path):
+def partial_marker(vtt_file):
+    """Returns the path of the marker that exists while a VTT file is still being written."""
+    return f"{vtt_file}.partial"
+
+
+def is_partial_vtt(vtt_file):
+    """Whether a VTT file is an unfinished transcription that can be resumed."""
+    return os.path.exists(partial_marker(vtt_file))
+
+
+class IncrementalVttWriter:
+    """
+    Appends captions to a VTT file as they are transcribed.
+
+    Every caption is flushed right away, so readers such as `tail_vtt` see it, and the
+    file is fsynced at most every `fsync_interval` seconds. Until `close` the marker file
+    `partial_marker(output_path)` records the byte offset and the end time of the last
+    synced caption; reopening an unfinished file with `resume=True` cuts it back to
+    that offset and sets `resume_from`, so the transcription continues from there.
+    The finished file has exactly the content `WebVTT.save` writes for the captions.
+
+    Args:
+        output_path (str): The VTT file to write.
+        resume (bool, optional): Continue an unfinished file instead of starting over.
+            Defaults to True.
+        fsync_interval (float, optional): Seconds between fsyncs. Defaults to 5.
+    """
+
+    def __init__(self, output_path, resume=True, fsync_interval=VTT_FSYNC_INTERVAL):
+        self.output_path = output_path
+        self.marker = partial_marker(output_path)
+        self.fsync_interval = fsync_interval
+        self.resume_from = 0.0
+        self._end = 0.0
+
+        state = None
+        if resume and os.path.exists(output_path) and os.path.exists(self.marker):
+            try:
+                with open(self.marker, encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = None
+
+        if state and state["offset"] <= os.path.getsize(output_path):
+            self._file = open(output_path, "r+", encoding="utf-8", newline="\n")
+            self._file.truncate(state["offset"])
+            self._file.seek(state["offset"])
+            self.resume_from = self._end = state["end"]
+            logger.info(f"resuming {output_path} from {timedelta(seconds=self.resume_from)}")
+        else:
+            self._file = open(output_path, "w", encoding="utf-8", newline="\n")
+            self._file.write("WEBVTT\n")
+        self._sync()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # An interrupted transcription keeps its marker, so it can be resumed
+        self.close(complete=exc_type is None)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        tmp_file = f"{self.marker}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"offset": self._file.tell(), "end": self._end}, f)
+        os.replace(tmp_file, self.marker)
+        self._synced_at = time.monotonic()
+
+    def write(self, start, end, text):
+        """Appends a caption; start and end are in seconds."""
+        caption = _caption(start, end, text)
+        cue = ["", f"{caption.start} --> {caption.end}", *caption.lines]
+        self._file.write("\n".join(cue) + "\n")
+        self._file.flush()
+        self._end = end
+        if time.monotonic() - self._synced_at >= self.fsync_interval:
+            self._sync()
+
+    def close(self, complete=True):
+        """Syncs the file; a complete transcription also drops its partial marker."""
+        if self._file is None:
+            return
+        self._sync()
+        self._file.close()
+        self._file = None
+        if complete:
+            os.remove(self.marker)
+
+
+def _parse_cue(block):
+    lines = block.strip("\n").split("\n")
+    for i, line in enumerate(lines):
+        if " --> " in line:
+            start, end = line.split(" --> ", 1)
+            return Caption(start=start.strip(), end=end.split()[0], text=lines[i + 1 :])
+    return None
+
+
+def tail_vtt(vtt_file, poll_interval=0.5, timeout=None):
+    """
+    Follows a VTT file that is being written and yields its captions as they appear.
+
+    A caption is yielded once the next one has started or the file is finished, so a
+    half written caption is never returned. The iterator ends when the file is complete,
+    i.e. it exists without a partial marker.
+
+    Args:
+        vtt_file (str): The VTT file, which need not exist yet.
+        poll_interval (float, optional): Seconds between checks for new content.
+        timeout (float, optional): Stop after this many seconds without new content.
+            Defaults to waiting as long as the transcription runs.
+
+    Yields:
+        webvtt.Caption: The captions in file order.
+    """
+    position = 0
+    buffer = ""
+    header_seen = False
+    idle_since = time.monotonic()
+    while True:
+        finished = os.path.exists(vtt_file) and not is_partial_vtt(vtt_file)
+        chunk = ""
+        if os.path.exists(vtt_file):
+            with open(vtt_file, encoding="utf-8", newline="\n") as f:
+                f.seek(position)
+                chunk = f.read()
+                position = f.tell()
+        buffer += chunk
+        blocks = buffer.split("\n\n")
+        buffer = blocks.pop() if not finished else ""
+        for block in blocks:
+            if not header_seen:
+                header_seen = True
+                if block.startswith("WEBVTT"):
+                    continue
+            caption = _parse_cue(block)
+            if caption is not None:
+                yield caption
+        if finished:
+            return
+        if chunk:
+            idle_since = time.monotonic()
+        elif timeout is not None and time.monotonic() - idle_since > timeout:
+            return
+        time.sleep(poll_interval)
+
+
+def transcribe_segments(model, audio, start=0.0, batch_size=0):
+    """
+    Transcribes audio from `start` seconds on.
+
+    Without a batch size the model decodes one 30 second window after the other with
+    beam search, each conditioned on the text before. With a batch size the audio is
+    cut into VAD chunks of up to 30 seconds that are decoded `batch_size` at a time by
+    faster-whisper's BatchedInferencePipeline, which is much faster on long audio.
+
+    Args:
+        model (WhisperModel): The loaded model.
+        audio (str or numpy.ndarray): An audio file or 16 kHz mono samples.
+        start (float, optional): Seconds to skip. Defaults to 0.
+        batch_size (int, optional): Chunks decoded together, 0 for sequential decoding.
+
+    Yields:
+        tuple: start and end in seconds of the full audio, and the text of a segment.
+    """
+    if not batch_size:
+        segments, _ = model.transcribe(audio, beam_size=5, clip_timestamps=[start])
+        for segment in segments:
+            yield segment.start, segment.end, segment.text
+        return
+
+    # The pipeline has no seek option, so a resumed transcription gets the rest only
+    if start:
+        if isinstance(audio, str):
+            audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+        audio = audio[round(start * SAMPLE_RATE) :]
+    segments, _ = BatchedInferencePipeline(model).transcribe(
+        audio, beam_size=5, batch_size=batch_size
+    )
+    for segment in segments:
+        yield start + segment.start, start + segment.end, segment.text
+
+
+def plan_vad_split(audio, pieces, min_piece_seconds=MIN_PIECE_SECONDS, speech=None):
+    """
+    Splits audio into about equally long pieces, cutting in pauses found by the VAD.
+
+    Each cut is placed in the middle of the pause closest to its equal-length position,
+    if that pause lies within a quarter piece of it; otherwise the audio is cut at the
+    equal-length position. No piece is ever shorter than `min_piece_seconds`: fewer
+    pieces are used for short audio, and pauses that would leave a shorter piece are
+    skipped.
+
+    Args:
+        audio (numpy.ndarray): 16 kHz mono audio.
+        pieces (int): The number of pieces wanted.
+        min_piece_seconds (float, optional): The shortest piece. Defaults to 120.
+        speech (list, optional): Speech segments in samples, as returned by
+            `get_speech_timestamps`. Defaults to None (run the VAD on the audio).
+
+    Returns:
+        list: (start, end) of every piece in seconds, covering the whole audio.
+    """
+    duration = len(audio) / SAMPLE_RATE
+    pieces = max(1, min(pieces, int(duration // min_piece_seconds)))
+    if pieces == 1:
+        return [(0.0, duration)]
+
+    if speech is None:
+        speech = get_speech_timestamps(
+            audio, VadOptions(min_silence_duration_ms=SPLIT_SILENCE_MS, speech_pad_ms=0)
+        )
+    pauses = np.array(
+        [
+            (previous["end"] + following["start"]) / 2 / SAMPLE_RATE
+            for previous, following in zip(speech, speech[1:])
+        ]
+    )
+
+    # Cuts stay close enough to their targets that the equal-length position of the
+    # next cut, and the end of the audio, remain at least min_piece_seconds away
+    piece_seconds = duration / pieces
+    reach = min(piece_seconds / 4, piece_seconds - min_piece_seconds)
+    bounds = [0.0]
+    for k in range(1, pieces):
+        target = k * piece_seconds
+        cut = target
+        if len(pauses):
+            pause = float(pauses[np.argmin(np.abs(pauses - target))])
+            if (
+                abs(pause - target) <= reach
+                and pause - bounds[-1] >= min_piece_seconds
+                and duration - pause >= min_piece_seconds
+            ):
+                cut = pause
+        bounds.append(cut)
+    bounds.append(duration)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _transcribe_piece(audio_file, start, end, model_size, profile, batch_size):
+    """Transcribes one piece of the shared audio array in a worker process."""
     os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
+    audio = np.load(audio_file, mmap_mode="r")
+    piece = np.array(audio[round(start * SAMPLE_RATE) : round(end * SAMPLE_RATE)])
+    model = get_whisper_model(model_size, profile)
+    # Piece timestamps start at zero, shift them back onto the full audio
+    return [
+        (start + segment_start, min(start + segment_end, end), text)
+        for segment_start, segment_end, text in transcribe_segments(
+            model, piece, batch_size=batch_size
+        )
+    ]
+
+
+def transcribe_vtt_parallel(
+    audio_path,
+    model_size,
+    output_path,
+    workers,
+    profile=None,
+    resume=True,
+    dry_run=False,
+    batch_size=0,
+):
+    """
+    Transcribes long audio in VAD-split pieces across a pool of processes.
+
+    The audio is decoded once and shared with the workers through a memory-mapped
+    array. Every worker loads its own model and gets an equal share of the cores as
+    cpu_threads. The pieces are written to the VTT file in order, with their
+    timestamps moved back onto the full audio, as soon as all earlier pieces are done.
+
+    Args:
+        audio_path (str): The audio to transcribe.
+        model_size (str): The Whisper model.
+        output_path (str): The VTT file to write.
+        workers (int): The number of worker processes and pieces.
+        profile (dict, optional): The execution profile, see `resolve_stt_profile`.
+        resume (bool, optional): Continue an unfinished output file. Defaults to True.
+        dry_run (bool, optional): Only plan the split and return the report.
+        batch_size (int, optional): Batched decoding in the workers, see
+            `transcribe_segments`. Defaults to 0, sequential decoding.
+
+    Returns:
+        dict: The pieces as (start, end) seconds, the audio duration and the ideal
+            speedup, i.e. the duration over the longest piece.
+    """
+    audio = decode_audio(audio_path, sampling_rate=SAMPLE_RATE)
+    plan = plan_vad_split(audio, workers)
+    duration = len(audio) / SAMPLE_RATE
+    report = {
+        "pieces": plan,
+        "duration": duration,
+        "speedup": duration / max(end - start for start, end in plan),
+    }
+    pieces = ", ".join(
+        f"{timedelta(seconds=round(start))}-{timedelta(seconds=round(end))}"
+        for start, end in plan
+    )
+    logger.info(
+        f"split {audio_path} into {len(plan)} pieces ({pieces}), "
+        f"ideal speedup {report['speedup']:.2f}x"
+    )
+    if dry_run:
+        return report
+
+    profile = dict(profile or resolve_stt_profile(model_size))
+    if profile["device"] == "cpu":
+        profile["cpu_threads"] = max(1, _available_cores() // len(plan))
+
+    with tempfile.TemporaryDirectory() as temp_dir, IncrementalVttWriter(
+        output_path, resume=resume
+    ) as writer:
+        audio_file = os.path.join(temp_dir, "audio.npy")
+        np.save(audio_file, audio)
+        del audio
+        todo = [(start, end) for start, end in plan if end > writer.resume_from]
+        with ProcessPoolExecutor(
+            max_workers=len(todo) or 1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _transcribe_piece, audio_file, start, end, model_size, profile, batch_size
+                )
+                for start, end in todo
+            ]
+            for future in tqdm(futures):
+                for start, end, text in future.result():
+                    # Segments that overlap the resumed part were written before
+                    if end > writer.resume_from:
+                        writer.write(start, end, text)
+    return report
+
+
+def faster_whisper_transcribe_vtt(
+    audio_path,
+    model_size,
+    output_path,
+    profile=None,
+    resume=True,
+    workers=1,
+    dry_run=False,
+    batch_size=0,
+    cache=True,
+):
+    """
+    Transcribes an audio file into a VTT file, writing every caption as it is decoded.
+
+    Finished transcripts are cached by the content of the audio file, the model size,
+    the compute type and the decoding mode, so the same audio is transcribed once no
+    matter its title or output folder. An unfinished output file from an interrupted
+    run is continued from its last synced caption instead of being transcribed again
+    from the start. With several workers the audio is split at pauses and transcribed
+    in parallel, see `transcribe_vtt_parallel`.
+
+    Args:
+        audio_path (str): The audio to transcribe.
+        model_size (str): The Whisper model.
+        output_path (str): The VTT file to write.
+        profile (dict, optional): The execution profile, see `resolve_stt_profile`.
+        resume (bool, optional): Continue an unfinished output file. Defaults to True.
+        workers (int, optional): Worker processes for long audio. Defaults to 1.
+        dry_run (bool, optional): Only report the parallel split plan and its speedup.
+        batch_size (int, optional): Decode this many VAD chunks per model call, see
+            `transcribe_segments`. Defaults to 0, sequential decoding.
+        cache (bool, optional): Use and fill the transcript cache. Defaults to True.
+
+    Returns:
+        dict: The split report of a parallel or dry run, None otherwise.
+    """
+    os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
+    if dry_run:
+        return transcribe_vtt_parallel(
+            audio_path, model_size, output_path, workers, profile, dry_run=True
+        )
+
+    # GPU with FP16 when available, int8 on CPU, see resolve_stt_profile
+    profile = profile or resolve_stt_profile(model_size)
+    cache_key = None
+    if cache:
+        cache_key = make_key(
+            "transcript-v1",
+            file_fingerprint(audio_path),
+            model_size,
+            profile["compute_type"],
+            "batched" if batch_size else "sequential",
+        )
+        cached = transcript_cache.get(cache_key, ".vtt")
+        if cached is not None:
+            shutil.copyfile(cached, output_path)
+            if is_partial_vtt(output_path):
+                os.remove(partial_marker(output_path))
+            logger.info(f"transcript of {audio_path} taken from the cache")
+            return None
+
+    report = None
+    if workers > 1:
+        report = transcribe_vtt_parallel(
+            audio_path,
+            model_size,
+            output_path,
+            workers,
+            profile,
+            resume,
+            batch_size=batch_size,
+        )
+    else:
+        _transcribe_vtt(audio_path, model_size, output_path, profile, resume, batch_size)
+
+    if cache_key is not None:
+        transcript_cache.put(
+            cache_key, lambda path: shutil.copyfile(output_path, path), ".vtt"
+        )
+    return report
+
+
+def _transcribe_vtt(audio_path, model_size, output_path, profile, resume, batch_size):
+    """Transcribes in this process with one pooled model."""
+    model = get_whisper_model(model_size, profile)
+
+    with IncrementalVttWriter(output_path, resume=resume) as writer:
+        segments = transcribe_segments(model, audio_path, writer.resume_from, batch_size)
+        for start, end, text in tqdm(segments):
+            # Segments that overlap the resumed part were written before
+            if end <= writer.resume_from:
+                continue
+            writer.write(start, end, text)
+    logger.debug(f"whisper model pool: {model_pool.stats()}")
+
+
+def benchmark_batched_inference(
+    audio=None, model_size="base", batch_sizes=(4, 8, 16), profile=None
+):
+    """
+    Compares the real-time factor of sequential and batched decoding.
+
+    Args:
+        audio (str or numpy.ndarray, optional): The clip to transcribe; batching only
+            pays off on a few minutes of speech. Defaults to a synthetic 5 minute clip.
+        model_size (str, optional): The model to time. Defaults to "base".
+        batch_sizes (tuple, optional): The batch sizes to time. Defaults to (4, 8, 16).
+        profile (dict, optional): The execution profile, see `resolve_stt_profile`.
 
-    # Run on GPU with FP16
-    model = WhisperModel(model_size, device="cuda", compute_type="float16")
+    Returns:
+        list: One dict per run with batch_size (0 for sequential), segments, seconds and
+            rtf (real-time factor).
+    """
+    if audio is None:
+        audio = _reference_clip(seconds=300)
+    elif isinstance(audio, str):
+        audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+    duration = len(audio) / SAMPLE_RATE
+    model = get_whisper_model(model_size, profile)
 
-    segments, info = model.transcribe(audio_path, beam_size=5)
+    report = []
+    for batch_size in (0, *batch_sizes):
+        start = time.perf_counter()
+        segments = list(transcribe_segments(model, audio, batch_size=batch_size))
+        seconds = time.perf_counter() - start
+        report.append(
+            {
+                "batch_size": batch_size,
+                "segments": len(segments),
+                "seconds": seconds,
+                "rtf": seconds / duration,
+            }
+        )
+        logger.info(f"stt batch size {batch_size}: rtf {seconds / duration:.3f}")
+    return report
 
-    # Create a new WebVTT object
-    vtt = WebVTT()
 
-    # Loop through the segments and create captions
-    for segment in tqdm(segments):
-        # Convert start and end times to 'HH:MM:SS.MMM' format
-        start_time = str(timedelta(seconds=segment.start))
-        end_time = str(timedelta(seconds=segment.end))
+if __name__ == "__main__":
+    import argparse
 
-        # Ensure the timestamps have millisecond precision
-        if "." not in start_time:
-            start_time += ".000"
-        if "." not in end_time:
-            end_time += ".000"
+    parser = argparse.ArgumentParser(
+        description="Benchmark Whisper compute types and cache the fastest for this machine, "
+        "compare batched decoding or plan a parallel transcription"
+    )
+    parser.add_argument("--audio", type=str, default=None, help="reference clip")
+    parser.add_argument("--model_size", type=str, default="base", help="whisper model")
+    parser.add_argument("--device", type=str, default=None, help="cuda or cpu")
+    parser.add_argument(
+        "--split_workers",
+        type=int,
+        default=None,
+        help="only show how --audio would be split for this many parallel workers",
+    )
+    parser.add_argument(
+        "--batch_sizes",
+        type=int,
+        nargs="+",
+        default=None,
+        help="compare sequential and batched decoding of --audio at these batch sizes",
+    )
+    args = parser.parse_args()
 
-        # Create a new caption
-        caption = Caption(start=start_time, end=end_time, text=segment.text)
-        # Add the caption to the WebVTT object
-        vtt.captions.append(caption)
+    if args.batch_sizes:
+        rows = benchmark_batched_inference(args.audio, args.model_size, args.batch_sizes)
+        print(f"{'batch size':<12}{'segments':>10}{'run s':>8}{'rtf':>8}")
+        for row in rows:
+            print(
+                f"{row['batch_size'] or 'sequential':<12}{row['segments']:>10}"
+                f"{row['seconds']:>8.2f}{row['rtf']:>8.3f}"
+            )
+        raise SystemExit
 
-    # Save the WebVTT object to a .vtt file
-    vtt.save(output_path)
+    if args.split_workers:
+        report = faster_whisper_transcribe_vtt(
+            args.audio, args.model_size, None, workers=args.split_workers, dry_run=True
+        )
+        for start, end in report["pieces"]:
+            print(f"{timedelta(seconds=round(start))} - {timedelta(seconds=round(end))}")
+        print(f"ideal speedup: {report['speedup']:.2f}x")
+        raise SystemExit
+    rows = benchmark_stt_profiles(args.audio, args.model_size, args.device)
+    print(f"{'compute_type':<16}{'load s':>8}{'run s':>8}{'rtf':>8}")
+    for row in rows:
+        print(
+            f"{row['compute_type']:<16}{row['load_seconds']:>8.2f}"
+            f"{row['seconds']:>8.2f}{row['rtf']:>8.3f}"
+        )
+    print(f"profile: {resolve_stt_profile(args.model_size, args.device)}")
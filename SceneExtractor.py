@@ -1,106 +1,1465 @@
 # SceneExtractor
 import torch.nn.functional as F
 import cv2
+import heapq
 import numpy as np
+import multiprocessing
 import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
 import torch
-from torchvision import models, transforms
-from collections import OrderedDict
+from bisect import bisect_left, insort
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from cache_store import DiskCache, file_fingerprint, make_key
 from logger import logger
 
-# Initialize ResNet50 model, only keep up to the average pooling layer
-base_model = models.resnet50(pretrained=True)
-base_model = torch.nn.Sequential(*(list(base_model.children())[:-1]))
-base_model.eval()
+# ImageNet normalization constants, built once and broadcast over whole batches
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
 
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_SAMPLE_RATE = 1.0  # samples per second
+DEFAULT_BACKBONE = "resnet50"
+INPUT_SIZE = 224
+# Tolerance when mapping frame timestamps onto the sampling grid
+SAMPLE_EPSILON = 1e-6
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+# Batches buffered per decoder thread before it blocks
+DEFAULT_QUEUE_SIZE = 4
+# How far before a range start the grid sampler seeks, in seconds
+SEEK_MARGIN = 1.0
 
-def extract_features(frame):
+# Similarity series of already processed videos, a few hundred KB per hour of video
+SIMILARITY_CACHE_MAX_BYTES = 256 * 1024**2
+similarity_cache = DiskCache("scene_similarities", SIMILARITY_CACHE_MAX_BYTES)
+
+# Cheap-first cascade: histogram bits per channel and the distance that needs the CNN
+HISTOGRAM_BITS = 3
+DEFAULT_CASCADE_THRESHOLD = 0.05
+
+# Online detection: rolling percentile window and samples held back before deciding
+ONLINE_WINDOW = 600
+ONLINE_WARMUP = 60
+# Scene thumbnails handed to the docx writer; 480 px is about 80 dpi at 15 cm, and
+# every sample in flight is held at this size until its similarity is known
+DEFAULT_THUMBNAIL_CAPACITY = 256
+THUMBNAIL_WIDTH = 480
+THUMBNAIL_JPEG_QUALITY = 85
+
+# Exported ONNX backbones, rebuilt on demand
+ONNX_CACHE_MAX_BYTES = 1024**3
+onnx_cache = DiskCache("onnx_backbones", ONNX_CACHE_MAX_BYTES)
+
+
+class Backbone:
     """
-    Extracts features from a given frame.
+    A feature extractor used for scene detection.
 
     Args:
-        frame (numpy.ndarray): The input frame.
+        name (str): The registry name of the backbone.
+        model (torch.nn.Module): Maps a normalized (N, 3, H, W) batch to (N, feature_dim, ...).
+        input_size (int): The square input resolution frames are resized to.
+        feature_dim (int): The length of the flattened feature vector.
+    """
 
-    Returns:
-        numpy.ndarray: The extracted features.
+    def __init__(self, name, model, input_size, feature_dim):
+        self.name = name
+        self.model = model.eval()
+        self.input_size = input_size
+        self.feature_dim = feature_dim
+
+    def preprocess(self, frames):
+        x = torch.from_numpy(frames).permute(0, 3, 1, 2).float().div_(255.0)
+        return (x - MEAN) / STD
+
+    def __call__(self, frames):
+        """
+        Extracts features from a uint8 batch of shape (N, input_size, input_size, 3).
+
+        Returns:
+            numpy.ndarray: The extracted features, shape (N, feature_dim).
+        """
+        with torch.no_grad():
+            features = self.model(self.preprocess(frames))
+        return features.reshape(len(frames), -1).numpy()
+
+    def __repr__(self):
+        return f"Backbone({self.name}, input_size={self.input_size}, feature_dim={self.feature_dim})"
+
+
+class OnnxBackbone(Backbone):
+    """A backbone exported to ONNX and run with ONNX Runtime."""
+
+    def __init__(self, name, session, input_size, feature_dim):
+        self.name = name
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.input_size = input_size
+        self.feature_dim = feature_dim
+
+    def __call__(self, frames):
+        x = self.preprocess(frames).numpy()
+        (features,) = self.session.run(None, {self.input_name: x})
+        return features.reshape(len(frames), -1)
+
+
+BACKBONES = {}
+# Backbones are built on first use and then shared by every caller in the process;
+# re-entrant because onnx backbones build their torch source through get_backbone
+_loaded_backbones = {}
+_backbone_lock = threading.RLock()
+
+
+def register_backbone(name):
+    """Registers a function that builds a `Backbone` under the given name."""
+
+    def decorator(builder):
+        BACKBONES[name] = builder
+        return builder
+
+    return decorator
+
+
+@register_backbone("resnet50")
+def _build_resnet50():
+    from torchvision import models
+
+    # Only keep up to the average pooling layer
+    model = models.resnet50(pretrained=True)
+    model = torch.nn.Sequential(*(list(model.children())[:-1]))
+    return Backbone("resnet50", model, 224, 2048)
+
+
+@register_backbone("resnet18")
+def _build_resnet18():
+    from torchvision import models
+
+    model = models.resnet18(pretrained=True)
+    model = torch.nn.Sequential(*(list(model.children())[:-1]))
+    return Backbone("resnet18", model, 224, 512)
+
+
+@register_backbone("mobilenet_v3_small")
+def _build_mobilenet_v3_small():
+    from torchvision import models
+
+    model = models.mobilenet_v3_small(pretrained=True)
+    model = torch.nn.Sequential(model.features, model.avgpool)
+    return Backbone("mobilenet_v3_small", model, 224, 576)
+
+
+@register_backbone("mobilenet_v3_large")
+def _build_mobilenet_v3_large():
+    from torchvision import models
+
+    model = models.mobilenet_v3_large(pretrained=True)
+    model = torch.nn.Sequential(model.features, model.avgpool)
+    return Backbone("mobilenet_v3_large", model, 224, 960)
+
+
+@register_backbone("resnet50_int8")
+def _build_resnet50_int8():
+    # Dynamic quantization only covers Linear layers, which the pooled trunk does not
+    # have, so use torchvision's statically quantized int8 weights instead
+    from torchvision.models import quantization
+
+    model = quantization.resnet50(pretrained=True, quantize=True)
+    model.fc = torch.nn.Identity()
+    return Backbone("resnet50_int8", model, 224, 2048)
+
+
+def _build_onnx_backbone(name):
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError(
+            "onnxruntime is required for onnx backbones: pip install onnxruntime"
+        ) from e
+
+    base_name = name[len("onnx:") :]
+    source = get_backbone(base_name)
+    key = make_key("onnx-v1", base_name, torch.__version__)
+    onnx_path = onnx_cache.get(key, ".onnx")
+    if onnx_path is None:
+        logger.info(f"exporting {base_name} to ONNX")
+        dummy = torch.zeros(1, 3, source.input_size, source.input_size)
+
+        def export(path):
+            torch.onnx.export(
+                source.model,
+                dummy,
+                path,
+                input_names=["input"],
+                output_names=["features"],
+                dynamic_axes={"input": {0: "batch"}, "features": {0: "batch"}},
+            )
+
+        onnx_path = onnx_cache.put(key, export, ".onnx")
+
+    session = onnxruntime.InferenceSession(
+        onnx_path, providers=["CPUExecutionProvider"]
+    )
+    return OnnxBackbone(name, session, source.input_size, source.feature_dim)
+
+
+def get_backbone(name=DEFAULT_BACKBONE):
     """
-    img = cv2.resize(frame, (224, 224))
+    Returns a backbone by name, building it on first use.
 
-    # Convert to float tensor
-    x = torch.from_numpy(img).float()
+    Nothing is built or loaded when this module is imported: torchvision and the
+    weights are only touched by the first call for a given name, which holds a lock so
+    concurrent callers wait for one build instead of loading the weights twice.
 
-    # Reshape to (channels, height, width) and normalize
-    x = x.permute(2, 0, 1) / 255.0
-    mean = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
-    std = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
-    x = (x - mean) / std
+    Registered names are "resnet50", "resnet18", "mobilenet_v3_small",
+    "mobilenet_v3_large" and "resnet50_int8"; prefix any of them with "onnx:" to run
+    an ONNX export of it with ONNX Runtime (needs the onnxruntime package).
 
-    with torch.no_grad():
-        features = base_model(x)
-    return features.numpy()
+    Args:
+        name (str, optional): The backbone name. Defaults to "resnet50".
 
+    Returns:
+        Backbone: The backbone, shared by every caller in the process.
 
-def process_frame(frame_number, frame):
-    features = extract_features(frame)
-    return frame_number, features
+    Raises:
+        ValueError: If the name is not registered.
+    """
+    if isinstance(name, Backbone):
+        return name
+    backbone = _loaded_backbones.get(name)
+    if backbone is not None:
+        return backbone
+
+    with _backbone_lock:
+        backbone = _loaded_backbones.get(name)
+        if backbone is None:
+            if name.startswith("onnx:"):
+                backbone = _build_onnx_backbone(name)
+            elif name in BACKBONES:
+                backbone = BACKBONES[name]()
+            else:
+                raise ValueError(
+                    f"unknown backbone {name}, expected one of {list(BACKBONES)}"
+                )
+            logger.info(f"loaded {backbone}")
+            _loaded_backbones[name] = backbone
+    return backbone
 
 
-def calculate_similarities_parallel(video_path):
+def extract_features_batch(frames, backbone=DEFAULT_BACKBONE):
     """
-    Calculate similarities between frames in a video using parallel processing.
+    Extracts features from a batch of frames with a single forward pass.
 
     Args:
-        video_path (str): The path to the video file.
+        frames (numpy.ndarray): uint8 array of shape (N, input_size, input_size, 3).
+        backbone (str or Backbone, optional): The backbone to use. Defaults to "resnet50".
 
     Returns:
-        list: A list of tuples containing the frame number and similarity score.
+        numpy.ndarray: The extracted features, shape (N, feature_dim).
+    """
+    return get_backbone(backbone)(frames)
+
 
+def extract_features(frame, backbone=DEFAULT_BACKBONE):
     """
+    Extracts features from a given frame.
+
+    Args:
+        frame (numpy.ndarray): The input frame.
+        backbone (str or Backbone, optional): The backbone to use. Defaults to "resnet50".
+
+    Returns:
+        numpy.ndarray: The extracted features, shape (1, feature_dim).
+    """
+    backbone = get_backbone(backbone)
+    img = cv2.resize(frame, (backbone.input_size, backbone.input_size))
+    return extract_features_batch(img[np.newaxis], backbone)
+
+
+def _sample_time(slot, sample_rate):
+    """Returns the grid time of a sample slot, as int seconds when it is a whole second."""
+    t = slot / sample_rate
+    return int(t) if float(t).is_integer() else round(t, 3)
+
+
+def _open_capture(video_path, codec_threads=None):
+    if codec_threads and hasattr(cv2, "CAP_PROP_N_THREADS"):
+        return cv2.VideoCapture(
+            video_path, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, codec_threads]
+        )
+    return cv2.VideoCapture(video_path)
+
+
+def _video_duration(video_path):
+    """Returns the duration of a video in seconds, or None if it cannot be determined."""
     cap = cv2.VideoCapture(video_path)
-    features_dict = OrderedDict()
-    logger.debug(f"to threadPool in similarity calculation")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+    if fps > 0 and frame_count > 0:
+        return frame_count / fps
+    return None
 
-    last_processed_timestamp = -1.0  # Initialize to a negative value
 
+def _iter_read(cap, sample_rate, start_slot, end_slot):
+    # Legacy path: decode and convert every frame, keep one per sampling interval
+    interval = 1.0 / sample_rate
+    last_processed_timestamp = -1.0  # Initialize to a negative value
     while True:
         ret, frame = cap.read()
         if not ret:
             break
         timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000  # Get timestamp in seconds
+        if timestamp - last_processed_timestamp >= interval:
+            slot = int(timestamp * sample_rate + SAMPLE_EPSILON)
+            if end_slot is not None and slot >= end_slot:
+                break
+            yield _sample_time(slot, sample_rate), frame
+            last_processed_timestamp = timestamp
 
-        if (
-            timestamp - last_processed_timestamp >= 1.0
-        ):  # Check if at least 1 second has passed
-            timestamp, features = process_frame(timestamp, frame)
-            if features is not None:
-                features_dict[int(timestamp)] = features
-            last_processed_timestamp = timestamp  # Update the last processed timestamp
 
-    logger.debug(f"features len :{len(features_dict)}")
+def _iter_grab(cap, sample_rate, start_slot, end_slot):
+    # Same frames as _iter_read, but only the kept frames are converted and copied
+    interval = 1.0 / sample_rate
+    last_processed_timestamp = -1.0
+    while cap.grab():
+        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if timestamp - last_processed_timestamp < interval:
+            continue
+        slot = int(timestamp * sample_rate + SAMPLE_EPSILON)
+        if end_slot is not None and slot >= end_slot:
+            break
+        ret, frame = cap.retrieve()
+        if not ret:
+            break
+        yield _sample_time(slot, sample_rate), frame
+        last_processed_timestamp = timestamp
+
+
+def _iter_grid(cap, sample_rate, start_slot, end_slot):
+    # Keep the first frame of every slot on the wall-clock grid k / sample_rate
+    if start_slot:
+        # Land a little early and skip forward, so an imprecise seek cannot skip a slot
+        start_seconds = max(0.0, start_slot / sample_rate - SEEK_MARGIN)
+        cap.set(cv2.CAP_PROP_POS_MSEC, start_seconds * 1000)
+    next_slot = start_slot
+    while cap.grab():
+        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        slot = int(timestamp * sample_rate + SAMPLE_EPSILON)
+        if slot < next_slot:
+            continue
+        if end_slot is not None and slot >= end_slot:
+            break
+        ret, frame = cap.retrieve()
+        if not ret:
+            break
+        yield _sample_time(slot, sample_rate), frame
+        next_slot = slot + 1
+
+
+def _iter_seek(cap, sample_rate, start_slot, end_slot):
+    # Jump straight to each sample time; cheapest when samples are far apart
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    duration = frame_count / fps if fps > 0 and frame_count > 0 else None
+    slot = start_slot
+    while duration is None or slot / sample_rate < duration:
+        if end_slot is not None and slot >= end_slot:
+            break
+        cap.set(cv2.CAP_PROP_POS_MSEC, slot / sample_rate * 1000)
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield _sample_time(slot, sample_rate), frame
+        slot += 1
+
+
+SAMPLING_MODES = {
+    "read": _iter_read,
+    "grab": _iter_grab,
+    "grid": _iter_grid,
+    "seek": _iter_seek,
+}
+# Modes that can start decoding at an arbitrary slot and still pick the same frames
+SEEKABLE_SAMPLING_MODES = ("grid", "seek")
+
+
+def iter_sampled_frames(
+    video_path,
+    sample_rate=DEFAULT_SAMPLE_RATE,
+    sampling="grab",
+    start_slot=0,
+    end_slot=None,
+    codec_threads=None,
+):
+    """
+    Yields the frames of a video sampled at a fixed rate.
+
+    Sampling modes:
+        - "read": decode and convert every frame, keep one per interval (legacy behaviour).
+        - "grab": grab every frame but only retrieve the kept ones. Picks exactly the
+          same frames as "read" while skipping the colour conversion and copy of the rest.
+        - "grid": like "grab", but keeps the first frame of every slot k / sample_rate,
+          so samples do not drift on NTSC (29.97 fps) videos.
+        - "seek": seek to each sample time and decode a single frame. Best for sparse
+          sampling (e.g. 0.1 samples/sec) where most of the video can be skipped.
+
+    Args:
+        video_path (str): The path to the video file.
+        sample_rate (float, optional): Samples per second. Defaults to 1.0.
+        sampling (str, optional): One of "read", "grab", "grid" or "seek". Defaults to "grab".
+        start_slot (int, optional): The first sample slot to return. Only the "grid" and
+            "seek" modes can start after slot 0. Defaults to 0.
+        end_slot (int, optional): Stop before this sample slot. Defaults to None (end of video).
+        codec_threads (int, optional): Decoder threads for cv2.VideoCapture. Defaults to
+            None (OpenCV's choice).
+
+    Yields:
+        tuple: The sample time in seconds and the full resolution BGR frame.
+    """
+    assert sample_rate > 0, "sample_rate must be positive"
+    assert sampling in SAMPLING_MODES, f"sampling must be one of {list(SAMPLING_MODES)}"
+    assert (
+        start_slot == 0 or sampling in SEEKABLE_SAMPLING_MODES
+    ), f"only {SEEKABLE_SAMPLING_MODES} sampling can start after slot 0"
+
+    cap = _open_capture(video_path, codec_threads)
+    try:
+        yield from SAMPLING_MODES[sampling](cap, sample_rate, start_slot, end_slot)
+    finally:
+        cap.release()
+
+
+def read_frame_batches(
+    video_path,
+    batch_size=DEFAULT_BATCH_SIZE,
+    sample_rate=DEFAULT_SAMPLE_RATE,
+    sampling="grab",
+    start_slot=0,
+    end_slot=None,
+    codec_threads=None,
+    input_size=INPUT_SIZE,
+    thumbnails=None,
+):
+    """
+    Reads sampled frames from a video and groups them into mini-batches.
+
+    Frames are resized straight into a preallocated batch array, so each batch
+    can be handed to `extract_features_batch` without another copy.
+
+    Args:
+        video_path (str): The path to the video file.
+        batch_size (int, optional): The number of frames per batch. Defaults to 32.
+        sample_rate (float, optional): Samples per second. Defaults to 1.0.
+        sampling (str, optional): The frame sampling mode, see `iter_sampled_frames`.
+        start_slot (int, optional): The first sample slot to read. Defaults to 0.
+        end_slot (int, optional): Stop before this sample slot. Defaults to None.
+        codec_threads (int, optional): Decoder threads for cv2.VideoCapture. Defaults to None.
+        input_size (int, optional): The square size frames are resized to. Defaults to 224.
+        thumbnails (SceneThumbnails, optional): Gets a thumbnail of every sampled frame.
+
+    Yields:
+        tuple: A list of sample times (seconds) and a uint8 array of shape
+            (len(timestamps), input_size, input_size, 3).
+    """
+    batch = np.empty((batch_size, input_size, input_size, 3), dtype=np.uint8)
+    timestamps = []
+
+    for timestamp, frame in iter_sampled_frames(
+        video_path, sample_rate, sampling, start_slot, end_slot, codec_threads
+    ):
+        cv2.resize(frame, (input_size, input_size), dst=batch[len(timestamps)])
+        if thumbnails is not None:
+            thumbnails.add(timestamp, frame)
+        timestamps.append(timestamp)
+
+        if len(timestamps) == batch_size:
+            yield timestamps, batch
+            batch = np.empty_like(batch)
+            timestamps = []
+    if timestamps:
+        yield timestamps, batch[: len(timestamps)]
+
+
+def _read_exact(stream, view):
+    """Fills a memoryview from a binary stream, returning the number of bytes read."""
+    filled = 0
+    while filled < len(view):
+        n = stream.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled
+
+
+def read_frame_batches_ffmpeg(
+    video_path,
+    batch_size=DEFAULT_BATCH_SIZE,
+    sample_rate=DEFAULT_SAMPLE_RATE,
+    start_slot=0,
+    end_slot=None,
+    codec_threads=None,
+    input_size=INPUT_SIZE,
+):
+    """
+    Reads sampled frames through a single ffmpeg process and groups them into mini-batches.
+
+    ffmpeg selects the frames and scales them itself and writes bgr24 rawvideo to a
+    pipe, which is read directly into preallocated batch arrays. This skips both the
+    full resolution conversion in cv2.VideoCapture and the per-frame cv2.resize. Frames
+    are kept in BGR order so the features match the OpenCV path.
+
+    The frames are the ones the "grid" sampling mode picks: the first frame at or after
+    every slot k / sample_rate. ffmpeg's fps filter alone would take the frame nearest
+    to the slot time instead, which can be the last frame before a cut.
+
+    Args:
+        video_path (str): The path to the video file.
+        batch_size (int, optional): The number of frames per batch. Defaults to 32.
+        sample_rate (float, optional): Samples per second. Defaults to 1.0.
+        start_slot (int, optional): The first sample slot to read. Defaults to 0.
+        end_slot (int, optional): Stop before this sample slot. Defaults to None.
+        codec_threads (int, optional): ffmpeg decoder threads. Defaults to None (ffmpeg's choice).
+        input_size (int, optional): The square size frames are scaled to. Defaults to 224.
+
+    Yields:
+        tuple: A list of sample times (seconds) and a uint8 array of shape
+            (len(timestamps), input_size, input_size, 3).
+
+    Raises:
+        RuntimeError: If ffmpeg exits with an error.
+    """
+    assert sample_rate > 0, "sample_rate must be positive"
+
+    frame_shape = (input_size, input_size, 3)
+    frame_bytes = input_size * input_size * 3
+    cmd = [FFMPEG_BINARY, "-nostdin", "-v", "error"]
+    if codec_threads:
+        cmd += ["-threads", str(codec_threads)]
+    if start_slot:
+        cmd += ["-ss", str(start_slot / sample_rate)]
+    cmd += ["-i", video_path]
+    if end_slot is not None:
+        cmd += ["-frames:v", str(end_slot - start_slot)]
+    # Keep the first frame of every slot, then let fps number the slots (and repeat the
+    # last frame over a gap) without moving any kept frame to another slot
+    slot = f"floor(%s*{sample_rate}+{SAMPLE_EPSILON})"
+    select = (
+        f"select='isnan(prev_selected_t)+gt({slot % 't'},{slot % 'prev_selected_t'})'"
+    )
+    cmd += [
+        "-vf",
+        f"{select},fps={sample_rate}:round=down,"
+        f"scale={input_size}:{input_size}:flags=bilinear",
+        "-pix_fmt",
+        "bgr24",
+        "-f",
+        "rawvideo",
+        "pipe:1",
+    ]
+    logger.debug(f"ffmpeg frame source: {' '.join(cmd)}")
+
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        slot = start_slot
+        finished = killed = False
+        try:
+            while True:
+                batch = np.empty((batch_size,) + frame_shape, dtype=np.uint8)
+                buffer = memoryview(batch).cast("B")
+                n = 0
+                while n < batch_size:
+                    view = buffer[n * frame_bytes : (n + 1) * frame_bytes]
+                    if _read_exact(proc.stdout, view) < frame_bytes:
+                        break
+                    n += 1
+                if n:
+                    timestamps = [
+                        _sample_time(i, sample_rate) for i in range(slot, slot + n)
+                    ]
+                    slot += n
+                    yield timestamps, batch[:n]
+                if n < batch_size:
+                    break
+            finished = True
+        finally:
+            proc.stdout.close()
+            if not finished and proc.poll() is None:
+                # Stopped early by the consumer; the exit code of a killed process is
+                # platform specific, so it is not checked
+                proc.kill()
+                killed = True
+            returncode = proc.wait()
+
+        if returncode != 0 and not killed:
+            stderr.seek(0)
+            message = stderr.read().decode(errors="replace").strip()
+            raise RuntimeError(f"ffmpeg failed on {video_path}: {message}")
+
+
+FRAME_SOURCES = ("opencv", "ffmpeg")
+
+
+def _frame_batches(
+    video_path,
+    frame_source,
+    batch_size,
+    sample_rate,
+    sampling,
+    start_slot=0,
+    end_slot=None,
+    codec_threads=None,
+    input_size=INPUT_SIZE,
+    thumbnails=None,
+):
+    assert frame_source in FRAME_SOURCES, f"frame_source must be one of {FRAME_SOURCES}"
+    if frame_source == "ffmpeg":
+        # ffmpeg always samples on the grid, and only ever sees scaled frames
+        return read_frame_batches_ffmpeg(
+            video_path,
+            batch_size,
+            sample_rate,
+            start_slot,
+            end_slot,
+            codec_threads,
+            input_size,
+        )
+    return read_frame_batches(
+        video_path,
+        batch_size,
+        sample_rate,
+        sampling,
+        start_slot,
+        end_slot,
+        codec_threads,
+        input_size,
+        thumbnails,
+    )
+
+
+def _split_slots(video_path, sample_rate, parts, align=1, start_slot=0, end_slot=None):
+    """
+    Splits sample slots [start_slot, end_slot) of a video into at most `parts` contiguous
+    (start, end) ranges; end_slot None stands for the end of the video.
+
+    Range starts are offset from start_slot by multiples of `align`; aligning to the batch
+    size keeps every batch identical to a single sequential pass, so the features are
+    bit-for-bit the same.
+    """
+    if parts <= 1:
+        return [(start_slot, end_slot)]
+    total_slots = end_slot
+    if total_slots is None:
+        duration = _video_duration(video_path)
+        if not duration:
+            return [(start_slot, end_slot)]
+        total_slots = int(np.ceil(duration * sample_rate))
+    total_blocks = int(np.ceil((total_slots - start_slot) / align))
+    bounds = sorted(
+        {start_slot + round(i * total_blocks / parts) * align for i in range(parts)}
+    )
+    return list(zip(bounds, bounds[1:] + [end_slot]))
+
+
+_END_OF_STREAM = object()
+
+
+def _put(out_queue, item, stop_event):
+    """Blocks until the item is queued, giving up once stop_event is set."""
+    while not stop_event.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _decode_worker(batches, out_queue, stop_event):
+    try:
+        for batch in batches:
+            if not _put(out_queue, batch, stop_event):
+                return
+        _put(out_queue, _END_OF_STREAM, stop_event)
+    except Exception as e:
+        _put(out_queue, e, stop_event)
+    finally:
+        batches.close()
+
+
+def iter_frame_batches(
+    video_path,
+    batch_size=DEFAULT_BATCH_SIZE,
+    sample_rate=DEFAULT_SAMPLE_RATE,
+    sampling="grab",
+    frame_source="opencv",
+    decode_threads=1,
+    queue_size=DEFAULT_QUEUE_SIZE,
+    codec_threads=None,
+    input_size=INPUT_SIZE,
+    start_slot=0,
+    end_slot=None,
+    thumbnails=None,
+):
+    """
+    Decodes frame batches on background threads and yields them in time order.
+
+    The video is split into `decode_threads` contiguous time ranges, each decoded by its
+    own thread into its own bounded queue. Batches are consumed range by range, so the
+    output order is the same as a single sequential decode, while the later ranges are
+    prefetched and decoding overlaps with whatever the caller does with each batch.
+    A full queue blocks its decoder (backpressure); an error in a decoder is re-raised
+    here, and closing the generator stops and joins every decoder thread.
+
+    Args:
+        video_path (str): The path to the video file.
+        batch_size (int, optional): The number of frames per batch. Defaults to 32.
+        sample_rate (float, optional): Samples per second. Defaults to 1.0.
+        sampling (str, optional): The frame sampling mode, see `iter_sampled_frames`.
+        frame_source (str, optional): "opencv" or "ffmpeg". Defaults to "opencv".
+        decode_threads (int, optional): The number of decoder threads. More than one needs
+            a sampling mode that can seek ("grid", "seek") or the ffmpeg source. Defaults to 1.
+        queue_size (int, optional): Batches buffered per decoder thread. Defaults to 4.
+        codec_threads (int, optional): Codec threads inside each decoder. Defaults to None.
+        input_size (int, optional): The square size frames are resized to. Defaults to 224.
+        start_slot (int, optional): The first sample slot to decode. Defaults to 0.
+        end_slot (int, optional): Stop before this sample slot. Defaults to None.
+        thumbnails (SceneThumbnails, optional): Gets a thumbnail of every sampled frame
+            (OpenCV frame source only).
+
+    Yields:
+        tuple: A list of sample times (seconds) and a uint8 frame batch.
+    """
+    assert decode_threads >= 1, "decode_threads must be at least 1"
+    assert queue_size >= 1, "queue_size must be at least 1"
+    if (
+        decode_threads > 1
+        and frame_source == "opencv"
+        and sampling not in SEEKABLE_SAMPLING_MODES
+    ):
+        logger.warning(
+            f"sampling {sampling} must decode from the start, using one decoder thread"
+        )
+        decode_threads = 1
+
+    slot_ranges = _split_slots(
+        video_path, sample_rate, decode_threads, batch_size, start_slot, end_slot
+    )
+    queues = [queue.Queue(maxsize=queue_size) for _ in slot_ranges]
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(
+            target=_decode_worker,
+            args=(
+                _frame_batches(
+                    video_path,
+                    frame_source,
+                    batch_size,
+                    sample_rate,
+                    sampling,
+                    range_start,
+                    range_end,
+                    codec_threads,
+                    input_size,
+                    thumbnails,
+                ),
+                out_queue,
+                stop_event,
+            ),
+            name=f"scene-decoder-{i}",
+            daemon=True,
+        )
+        for i, ((range_start, range_end), out_queue) in enumerate(
+            zip(slot_ranges, queues)
+        )
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for out_queue in queues:
+            while True:
+                item = out_queue.get()
+                if item is _END_OF_STREAM:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+
+@contextmanager
+def _thread_budget(thread_budget, decode_threads):
+    """
+    Splits a thread budget between the decoder threads and torch for one run.
+
+    Yields the number of codec threads each decoder may use, or None when no
+    budget is set and both libraries keep their own defaults.
+    """
+    if not thread_budget:
+        yield None
+        return
+    # Every decoder runs a single codec thread, torch gets the rest
+    inference_threads = max(1, thread_budget - decode_threads)
+    previous = torch.get_num_threads()
+    torch.set_num_threads(inference_threads)
+    logger.debug(
+        f"thread budget {thread_budget}: {decode_threads} decoder, "
+        f"{inference_threads} inference threads"
+    )
+    try:
+        yield 1
+    finally:
+        torch.set_num_threads(previous)
+
+
+def color_histograms(frames, bits=HISTOGRAM_BITS):
+    """
+    Computes normalized color histograms for a batch of frames in one vectorized pass.
+
+    Args:
+        frames (numpy.ndarray): uint8 array of shape (N, H, W, 3).
+        bits (int, optional): Bits kept per channel, giving 2 ** (3 * bits) bins. Defaults to 3.
+
+    Returns:
+        numpy.ndarray: float32 array of shape (N, 2 ** (3 * bits)) whose rows sum to 1.
+    """
+    n = len(frames)
+    bins = 1 << (3 * bits)
+    q = frames.reshape(n, -1, 3) >> (8 - bits)
+    index = (q[..., 0].astype(np.int32) << (2 * bits)) | (q[..., 1] << bits) | q[..., 2]
+    index += np.arange(n, dtype=np.int32)[:, np.newaxis] * bins
+    counts = np.bincount(index.ravel(), minlength=n * bins).reshape(n, bins)
+    return (counts / index.shape[1]).astype(np.float32)
+
+
+def _cascade_gate(histograms, reference, threshold):
+    """
+    Decides which frames need the CNN.
+
+    A frame is short-circuited when its histogram distance (half the L1 distance, in
+    [0, 1]) to the last frame that went through the CNN is below `threshold`. Comparing
+    against that reference rather than the previous sample means slow fades still add
+    up and reach the CNN.
+
+    Returns:
+        tuple: A boolean mask of the frames to run through the CNN, and the new reference.
+    """
+    need_cnn = np.ones(len(histograms), dtype=bool)
+    for i, histogram in enumerate(histograms):
+        if reference is not None and 0.5 * np.abs(histogram - reference).sum() < threshold:
+            need_cnn[i] = False
+        else:
+            reference = histogram
+    return need_cnn, reference
+
+
+def _cascade_features(frames, need_cnn, last_features, backbone):
+    """
+    Runs the CNN on the selected frames only; the others reuse the feature before them.
+    """
+    computed = np.flatnonzero(need_cnn)
+    # Index of the latest computed frame at or before every position, -1 for none yet
+    source = np.maximum.accumulate(np.where(need_cnn, np.arange(len(frames)), -1))
+
+    if len(computed):
+        cnn_features = torch.from_numpy(extract_features_batch(frames[computed], backbone))
+        features = cnn_features[np.searchsorted(computed, np.maximum(source, 0))]
+    else:
+        features = last_features.expand(len(frames), -1).clone()
+    if (source < 0).any():
+        features[source < 0] = last_features
+    return features
+
+
+class SceneThumbnails:
+    """
+    A bounded cache of JPEG thumbnails of the samples most likely to be scene changes.
+
+    While similarities are calculated, the decoding threads hand over a downscaled copy
+    of every sampled frame (`add`); once its similarity to the previous sample is known
+    (`rank`), only frames among the `capacity` lowest similarities are JPEG-encoded and
+    kept, all others are dropped unencoded. Scene changes are always the
+    lowest-similarity samples, so a video with at most `capacity` scene changes has all
+    of them cached and its pictures need no second decode. `select` then narrows the
+    cache down to the detected scene changes.
+
+    Only the OpenCV frame source sees full-size frames; the ffmpeg source, sharded runs
+    and similarity cache hits leave the cache empty.
+
+    Args:
+        capacity (int, optional): The maximum number of thumbnails kept. Defaults to 256.
+        width (int, optional): The maximum thumbnail width in pixels. Defaults to 480.
+    """
+
+    def __init__(self, capacity=DEFAULT_THUMBNAIL_CAPACITY, width=THUMBNAIL_WIDTH):
+        self.capacity = capacity
+        self.width = width
+        self.scene_frames = []
+        # Raw downscaled frames by timestamp, waiting for their similarity
+        self._pending = {}
+        # Max-heap on similarity: (-similarity, timestamp, jpeg)
+        self._ranked = []
+        self._lock = threading.Lock()
+
+    def add(self, timestamp, frame):
+        """Holds a downscaled copy of a sampled frame until its similarity is known."""
+        height, width = frame.shape[:2]
+        if width > self.width:
+            frame = cv2.resize(
+                frame,
+                (self.width, round(height * self.width / width)),
+                interpolation=cv2.INTER_AREA,
+            )
+        else:
+            frame = frame.copy()
+        with self._lock:
+            self._pending[timestamp] = frame
+
+    def _admitted(self, key):
+        return len(self._ranked) < self.capacity or key > self._ranked[0][:2]
+
+    def rank(self, timestamp, similarity):
+        """Encodes and keeps the thumbnail if its similarity is among the lowest so far."""
+        key = (-similarity, timestamp)
+        with self._lock:
+            frame = self._pending.pop(timestamp, None)
+            if frame is None or self.capacity <= 0 or not self._admitted(key):
+                return
+
+        # Encoded outside the lock, so the decoding threads are not held up
+        ret, buffer = cv2.imencode(
+            ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_JPEG_QUALITY]
+        )
+        if not ret:
+            return
+        with self._lock:
+            if len(self._ranked) < self.capacity:
+                heapq.heappush(self._ranked, (*key, buffer.tobytes()))
+            elif self._admitted(key):
+                heapq.heapreplace(self._ranked, (*key, buffer.tobytes()))
+
+    def select(self, scene_changes):
+        """
+        Narrows the cache down to the given scene changes and frees everything else.
+
+        Returns:
+            list: The scene change times paired with their JPEG bytes, or None where the
+                thumbnail was not cached. Also kept as `scene_frames`.
+        """
+        with self._lock:
+            kept = {timestamp: jpeg for _, timestamp, jpeg in self._ranked}
+            self._pending.clear()
+            self._ranked = []
+            self.scene_frames = [(t, kept.get(t)) for t in scene_changes]
+        cached = sum(jpeg is not None for _, jpeg in self.scene_frames)
+        logger.info(f"scene thumbnails: {cached}/{len(self.scene_frames)} cached")
+        return self.scene_frames
+
+
+def _similarity_cache_key(
+    video_path, sample_rate, sampling, frame_source, backbone, cascade_threshold
+):
+    # decode_threads and batch_size do not change which frames are compared
+    return make_key(
+        "similarities-v1",
+        file_fingerprint(video_path),
+        float(sample_rate),
+        "grid" if frame_source == "ffmpeg" else sampling,
+        frame_source,
+        backbone.name,
+        backbone.input_size,
+        cascade_threshold,
+    )
+
+
+def _save_npy(path, array):
+    # np.save appends ".npy" to bare paths, so hand it an open file instead
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def _time_value(t):
+    t = float(t)
+    return int(t) if t.is_integer() else t
+
+
+def iter_similarities(
+    video_path,
+    batch_size=DEFAULT_BATCH_SIZE,
+    sample_rate=DEFAULT_SAMPLE_RATE,
+    sampling="grab",
+    frame_source="opencv",
+    decode_threads=1,
+    queue_size=DEFAULT_QUEUE_SIZE,
+    thread_budget=None,
+    cache=True,
+    cascade=False,
+    cascade_threshold=DEFAULT_CASCADE_THRESHOLD,
+    stats=None,
+    backbone=DEFAULT_BACKBONE,
+    thumbnails=None,
+):
+    """
+    Yields the similarity of every sample to the previous one, in time order.
+
+    Sampled frames are gathered into mini-batches and pushed through the model
+    one batch at a time; throughput is logged so batch_size can be tuned per machine.
+    Decoding runs on background threads (see `iter_frame_batches`) and overlaps with
+    inference on the calling thread. Only the last feature vector is kept between
+    batches, so memory does not grow with the length of the video.
+
+    Results are cached on disk per video content, sampling settings and backbone
+    (see `similarity_cache`), so re-running on an already processed video skips
+    decoding and inference entirely. A series is only cached once the whole video
+    has been scanned; until then it is spooled to a temporary file, and a cached one is
+    read back through a memory map, so caching does not hold the series in memory.
+
+    With `cascade` enabled, a vectorized color histogram runs first and frames that are
+    nearly identical to the last CNN frame skip the CNN; they reuse its features and get
+    a similarity of 1. On lecture and talking-head videos most samples are short-circuited.
+
+    Args:
+        video_path (str): The path to the video file.
+        batch_size (int, optional): The number of frames per forward pass. Defaults to 32.
+        sample_rate (float, optional): Samples per second. Defaults to 1.0.
+        sampling (str, optional): The frame sampling mode, see `iter_sampled_frames`.
+            Ignored by the ffmpeg frame source, which always samples on the grid.
+        frame_source (str, optional): "opencv" (cv2.VideoCapture) or "ffmpeg"
+            (rawvideo pipe, see `read_frame_batches_ffmpeg`). Defaults to "opencv".
+        decode_threads (int, optional): The number of decoder threads. Defaults to 1.
+        queue_size (int, optional): Batches buffered per decoder thread. Defaults to 4.
+        thread_budget (int, optional): Total threads for decoding plus inference, so
+            several jobs on one machine do not oversubscribe it. Defaults to None
+            (no limit).
+        cache (bool, optional): Read and write the on-disk similarity cache. Defaults to True.
+        cascade (bool, optional): Gate the CNN with a color histogram distance. Defaults to False.
+        cascade_threshold (float, optional): Histogram distance in [0, 1] below which a
+            frame skips the CNN. Defaults to 0.05.
+        stats (dict, optional): Filled in place with "frames", "cnn_frames" and
+            "short_circuited" counts once the video has been scanned.
+        backbone (str or Backbone, optional): The feature extractor, see `get_backbone`.
+            Defaults to "resnet50".
+        thumbnails (SceneThumbnails, optional): Collects thumbnails of the likely scene
+            changes while the video is decoded. Stays empty on a cache hit.
+
+    Yields:
+        tuple: The sample time in seconds and its similarity to the previous sample.
+    """
+    assert batch_size >= 1, "batch_size must be at least 1"
+    backbone = get_backbone(backbone)
+
+    if cache:
+        cache_key = _similarity_cache_key(
+            video_path,
+            sample_rate,
+            sampling,
+            frame_source,
+            backbone,
+            cascade_threshold if cascade else None,
+        )
+        cached = _cached_series(cache_key)
+        if cached is not None:
+            yield from _iter_series(cached)
+            return
+
+    logger.debug(
+        f"batched similarity calculation, batch_size:{batch_size}, "
+        f"sample_rate:{sample_rate}, sampling:{sampling}, frame_source:{frame_source}, "
+        f"decode_threads:{decode_threads}, backbone:{backbone.name}"
+    )
 
-    # Calculate similarities after all futures have completed
-    similarities = []
     last_features = None
+    counts = {"frames": 0, "cnn_frames": 0}
+    start = time.perf_counter()
+    # The series only goes to disk, to fill the cache once the video is done
+    spool = tempfile.TemporaryFile() if cache else nullcontext()
+    with spool, _thread_budget(thread_budget, decode_threads) as codec_threads:
+        for timestamps, features in _iter_features(
+            video_path,
+            batch_size,
+            sample_rate,
+            sampling,
+            frame_source,
+            decode_threads,
+            queue_size,
+            codec_threads,
+            backbone,
+            cascade,
+            cascade_threshold,
+            counts,
+            thumbnails=thumbnails,
+        ):
+            timestamps, sims, last_features = _pair_similarities(
+                timestamps, features, last_features
+            )
+            if cache:
+                # Two float64 per sample, the rows of the cached .npy array
+                rows = np.column_stack([timestamps, sims]).astype(np.float64)
+                spool.write(rows.tobytes())
+            for timestamp, sim in zip(timestamps, sims):
+                if thumbnails is not None:
+                    thumbnails.rank(timestamp, sim)
+                yield timestamp, sim
+
+        _log_run(counts, time.perf_counter() - start, batch_size, cascade, stats)
+        if cache:
+            _store_spooled_series(cache_key, spool)
+
+
+def _cached_series(cache_key):
+    cached_path = similarity_cache.get(cache_key, ".npy")
+    if cached_path is not None:
+        logger.info(f"similarities loaded from cache: {cached_path}")
+    return cached_path
+
+
+def _iter_series(cached_path):
+    for t, sim in np.load(cached_path, mmap_mode="r"):
+        yield _time_value(t), float(sim)
+
+
+def _load_series(cache_key):
+    cached_path = _cached_series(cache_key)
+    if cached_path is None:
+        return None
+    return list(_iter_series(cached_path))
 
-    for frame_number, features in sorted(features_dict.items()):
-        if last_features is not None:
-            # Flatten the feature vectors to 1D
-            features = features.reshape(-1)
-            last_features = last_features.reshape(-1)
 
-            # Use PyTorch's cosine_similarity function
-            sim = F.cosine_similarity(
-                torch.from_numpy(features), torch.from_numpy(last_features), dim=0
+def _store_series(cache_key, series):
+    series = np.array(series, dtype=np.float64).reshape(-1, 2)
+    similarity_cache.put(cache_key, lambda path: _save_npy(path, series), ".npy")
+
+
+def _store_spooled_series(cache_key, spool):
+    """Caches the float64 rows spooled to a file as an (N, 2) .npy array."""
+    rows = spool.tell() // (2 * 8)
+
+    def write(path):
+        spool.seek(0)
+        with open(path, "wb") as f:
+            np.lib.format.write_array_header_1_0(
+                f,
+                {
+                    "descr": np.lib.format.dtype_to_descr(np.dtype(np.float64)),
+                    "fortran_order": False,
+                    "shape": (rows, 2),
+                },
             )
+            shutil.copyfileobj(spool, f)
 
-            # Convert the similarity to a float
-            similarities.append((frame_number, sim.item()))
-        last_features = features
-    cap.release()
+    similarity_cache.put(cache_key, write, ".npy")
+
+
+def _iter_features(
+    video_path,
+    batch_size,
+    sample_rate,
+    sampling,
+    frame_source,
+    decode_threads,
+    queue_size,
+    codec_threads,
+    backbone,
+    cascade,
+    cascade_threshold,
+    counts,
+    start_slot=0,
+    end_slot=None,
+    thumbnails=None,
+):
+    """Yields (timestamps, feature tensor) per batch and counts frames sent to the CNN."""
+    last_features = None
+    reference_histogram = None
+    for timestamps, frames in iter_frame_batches(
+        video_path,
+        batch_size,
+        sample_rate,
+        sampling,
+        frame_source,
+        decode_threads,
+        queue_size,
+        codec_threads,
+        backbone.input_size,
+        start_slot,
+        end_slot,
+        thumbnails,
+    ):
+        if cascade:
+            need_cnn, reference_histogram = _cascade_gate(
+                color_histograms(frames), reference_histogram, cascade_threshold
+            )
+            features = _cascade_features(frames, need_cnn, last_features, backbone)
+            counts["cnn_frames"] += int(need_cnn.sum())
+        else:
+            features = torch.from_numpy(extract_features_batch(frames, backbone))
+            counts["cnn_frames"] += len(frames)
+        counts["frames"] += len(timestamps)
+        last_features = features[-1:]
+        yield timestamps, features
+
+
+def _pair_similarities(timestamps, features, last_features):
+    """
+    Compares every sample of a batch with the one before it.
+
+    Returns:
+        tuple: The timestamps that got a similarity, the similarities, and the last
+            feature row to carry into the next batch.
+    """
+    if last_features is not None:
+        features = torch.cat([last_features, features])
+    else:
+        timestamps = timestamps[1:]
+
+    # Compare every sample with the previous one in a single vectorized call
+    sims = F.cosine_similarity(features[1:], features[:-1], dim=1)
+    return timestamps, sims.tolist(), features[-1:]
+
+
+def _log_run(counts, elapsed, batch_size, cascade, stats):
+    frame_count, cnn_frame_count = counts["frames"], counts["cnn_frames"]
+    logger.debug(f"features len :{frame_count}")
+    if elapsed > 0:
+        logger.info(
+            f"feature extraction: {frame_count} frames in {elapsed:.1f}s "
+            f"({frame_count / elapsed:.1f} frames/sec, batch_size={batch_size})"
+        )
+    if cascade:
+        logger.info(
+            f"cascade: {frame_count - cnn_frame_count}/{frame_count} frames "
+            f"short-circuited before the CNN"
+        )
+    if stats is not None:
+        stats.update(
+            frames=frame_count,
+            cnn_frames=cnn_frame_count,
+            short_circuited=frame_count - cnn_frame_count,
+        )
+
+
+def _similarity_shard(video_path, start_slot, end_slot, thread_budget, options):
+    """
+    Runs in a worker process: similarities inside one shard plus its edge features.
+
+    Returns:
+        tuple: (first timestamp, first feature row) or None for an empty shard, the
+            in-shard timestamps and similarities, the last feature row and the counts.
+    """
+    backbone = get_backbone(options.pop("backbone"))
+    counts = {"frames": 0, "cnn_frames": 0}
+    first = None
+    last_features = None
+    timestamps, sims = [], []
+    with _thread_budget(thread_budget, 1) as codec_threads:
+        for batch_timestamps, features in _iter_features(
+            video_path,
+            decode_threads=1,
+            codec_threads=codec_threads,
+            backbone=backbone,
+            counts=counts,
+            start_slot=start_slot,
+            end_slot=end_slot,
+            **options,
+        ):
+            if first is None:
+                first = (batch_timestamps[0], features[:1].numpy())
+            batch_timestamps, batch_sims, last_features = _pair_similarities(
+                batch_timestamps, features, last_features
+            )
+            timestamps += batch_timestamps
+            sims += batch_sims
+    if last_features is not None:
+        last_features = last_features.numpy()
+    return first, timestamps, sims, last_features, counts
+
+
+def calculate_similarities_sharded(
+    video_path,
+    shards,
+    batch_size=DEFAULT_BATCH_SIZE,
+    sample_rate=DEFAULT_SAMPLE_RATE,
+    sampling="grab",
+    frame_source="opencv",
+    decode_threads=1,
+    queue_size=DEFAULT_QUEUE_SIZE,
+    thread_budget=None,
+    cache=True,
+    cascade=False,
+    cascade_threshold=DEFAULT_CASCADE_THRESHOLD,
+    stats=None,
+    backbone=DEFAULT_BACKBONE,
+    thumbnails=None,
+):
+    """
+    Calculate similarities with the video split into time shards across processes.
+
+    Every shard opens its own decoder seeked to its first sample and runs feature
+    extraction in its own process with thread_budget / shards torch threads. Shards
+    return their in-shard similarities plus their first and last feature vectors, which
+    are compared at every boundary when the series are stitched together. Shard starts
+    are aligned to the batch size, so every batch and every similarity is exactly what
+    a single-process run with the same settings produces. With `cascade` each shard
+    starts its own histogram reference, which can send a few more frames to the CNN.
+
+    Args:
+        video_path (str): The path to the video file.
+        shards (int): The number of worker processes.
+        sampling (str, optional): "grid" or "seek" with the OpenCV source. Other modes
+            cannot start mid-video, so a sharded run samples on the grid instead.
+            Defaults to "grab".
+        decode_threads (int, optional): Ignored, every shard decodes on one thread.
+        thread_budget (int, optional): Total threads across all shards. Defaults to the
+            number of CPUs.
+        thumbnails (SceneThumbnails, optional): Only filled when running in one process.
+        backbone (str or Backbone, optional): Registered backbones are built by name in
+            every worker; any other Backbone is pickled to them. Defaults to "resnet50".
+        Other arguments are the same as for `iter_similarities`.
+
+    Returns:
+        list: A list of tuples containing the frame number and similarity score.
+    """
+    assert shards >= 1, "shards must be at least 1"
+    if (
+        shards > 1
+        and frame_source == "opencv"
+        and sampling not in SEEKABLE_SAMPLING_MODES
+    ):
+        # The grid picks the frames "grab" does, without its drift at 29.97 fps, and
+        # can start at any slot
+        logger.info(f"{sampling} sampling cannot start mid-video, sampling on the grid")
+        sampling = "grid"
+    if shards == 1:
+        return list(
+            iter_similarities(
+                video_path,
+                batch_size,
+                sample_rate,
+                sampling,
+                frame_source,
+                decode_threads,
+                queue_size,
+                thread_budget,
+                cache,
+                cascade,
+                cascade_threshold,
+                stats,
+                backbone,
+                thumbnails,
+            )
+        )
+    if thumbnails is not None:
+        logger.info("scene thumbnails are not collected across processes")
+    # Registered backbones are rebuilt by name in every worker, others are pickled
+    worker_backbone = backbone
+    if isinstance(backbone, Backbone) and (
+        backbone.name in BACKBONES or backbone.name.startswith("onnx:")
+    ):
+        worker_backbone = backbone.name
+
+    if cache:
+        cache_key = _similarity_cache_key(
+            video_path,
+            sample_rate,
+            sampling,
+            frame_source,
+            get_backbone(backbone),
+            cascade_threshold if cascade else None,
+        )
+        cached = _load_series(cache_key)
+        if cached is not None:
+            return cached
+
+    slot_ranges = _split_slots(video_path, sample_rate, shards, batch_size)
+    shard_budget = max(1, (thread_budget or os.cpu_count() or 1) // len(slot_ranges))
+    options = {
+        "batch_size": batch_size,
+        "sample_rate": sample_rate,
+        "sampling": sampling,
+        "frame_source": frame_source,
+        "queue_size": queue_size,
+        "cascade": cascade,
+        "cascade_threshold": cascade_threshold,
+        "backbone": worker_backbone,
+    }
+    logger.info(
+        f"scene detection in {len(slot_ranges)} shards, {shard_budget} threads each: "
+        f"{slot_ranges}"
+    )
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=len(slot_ranges), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(
+                _similarity_shard,
+                video_path,
+                start_slot,
+                end_slot,
+                shard_budget,
+                dict(options),
+            )
+            for start_slot, end_slot in slot_ranges
+        ]
+        results = [future.result() for future in futures]
+
+    similarities = []
+    previous_last = None
+    counts = {"frames": 0, "cnn_frames": 0}
+    for first, timestamps, sims, last_features, shard_counts in results:
+        counts["frames"] += shard_counts["frames"]
+        counts["cnn_frames"] += shard_counts["cnn_frames"]
+        if first is None:
+            continue
+        if previous_last is not None:
+            # Stitch the shards: compare this shard's first sample with the one before it
+            first_timestamp, first_features = first
+            _, boundary_sims, _ = _pair_similarities(
+                [first_timestamp],
+                torch.from_numpy(first_features),
+                torch.from_numpy(previous_last),
+            )
+            similarities.append((first_timestamp, boundary_sims[0]))
+        similarities.extend(zip(timestamps, sims))
+        previous_last = last_features
+
+    _log_run(counts, time.perf_counter() - start, batch_size, cascade, stats)
+    if cache:
+        _store_series(cache_key, similarities)
     return similarities
 
 
-def detect_scene_changes(video_path, alpha=0, frame_per_minute=0):
+def calculate_similarities_parallel(video_path, shards=1, **kwargs):
+    """
+    Calculate similarities between frames in a video using batched inference.
+
+    Args:
+        video_path (str): The path to the video file.
+        shards (int, optional): Split the video into this many time shards processed in
+            parallel processes, see `calculate_similarities_sharded`. Defaults to 1.
+        **kwargs: Passed on to `iter_similarities` (batch_size, sample_rate, sampling,
+            frame_source, decode_threads, queue_size, thread_budget, cache, cascade,
+            cascade_threshold, stats, backbone).
+
+    Returns:
+        list: A list of tuples containing the frame number and similarity score.
+
+    """
+    if shards > 1:
+        return calculate_similarities_sharded(video_path, shards, **kwargs)
+    return list(iter_similarities(video_path, **kwargs))
+
+
+def detect_scene_changes(video_path, alpha=0, frame_per_minute=0, **kwargs):
     """
     Detects scene changes in a video based on similarity scores between frames.
 
@@ -110,6 +1469,9 @@ def detect_scene_changes(video_path, alpha=0, frame_per_minute=0):
             to consider as a scene change. Defaults to 0.
         frame_per_minute (float, optional): The number of frames per minute to consider as a scene change.
             Defaults to 0.
+        **kwargs: Passed on to `calculate_similarities_parallel` (shards, batch_size,
+            sample_rate, sampling, frame_source, decode_threads, queue_size, thread_budget,
+            cache, cascade, cascade_threshold, stats, backbone, thumbnails).
 
     Returns:
         list: A list of time points (in seconds) where scene changes occur.
@@ -127,11 +1489,35 @@ def detect_scene_changes(video_path, alpha=0, frame_per_minute=0):
 
     logger.debug(f"video_path:{video_path}")
 
-    similarities = calculate_similarities_parallel(video_path)
+    similarities = calculate_similarities_parallel(video_path, **kwargs)
     logger.debug(f"similarities:{similarities}")
 
     assert similarities, "similarities is empty"
 
+    return scene_changes_from_similarities(
+        similarities,
+        alpha,
+        frame_per_minute,
+        kwargs.get("sample_rate", DEFAULT_SAMPLE_RATE),
+    )
+
+
+def scene_changes_from_similarities(
+    similarities, alpha=0, frame_per_minute=0, sample_rate=DEFAULT_SAMPLE_RATE
+):
+    """
+    Picks the scene changes out of a similarity series, see `detect_scene_changes`.
+
+    Args:
+        similarities (list): (time in seconds, similarity) tuples.
+        alpha (float, optional): Standard deviations below the mean similarity. Defaults to 0.
+        frame_per_minute (float, optional): Frames per minute to consider as a scene change.
+            Defaults to 0.
+        sample_rate (float, optional): Samples per second of the series. Defaults to 1.0.
+
+    Returns:
+        list: A list of time points (in seconds) where scene changes occur.
+    """
     similarity_scores = [sim for _, sim in similarities]
     assert similarity_scores, "similarity_scores is empty"
 
@@ -139,9 +1525,9 @@ def detect_scene_changes(video_path, alpha=0, frame_per_minute=0):
     std_sim = np.std(similarity_scores)
     threshold = mean_sim - alpha * std_sim
     logger.debug(f"similarity_scores:{similarity_scores}")
-    percentile = np.percentile(
-        similarity_scores, round(1 / 60 * 100 * frame_per_minute)
-    )
+    # frame_per_minute is relative to the number of samples taken per minute
+    percentile_rank = min(100, round(100 * frame_per_minute / (60 * sample_rate)))
+    percentile = np.percentile(similarity_scores, percentile_rank)
     scene_changes = []
     logger.debug(f"scene threshold:{threshold}")
     for frame_number, sim in similarities:
@@ -152,3 +1538,255 @@ def detect_scene_changes(video_path, alpha=0, frame_per_minute=0):
             time_in_seconds = frame_number
             scene_changes.append(time_in_seconds)
     return scene_changes
+
+
+def _scene_change_agreement(candidate, reference, tolerance):
+    """Precision, recall and F1 of candidate scene changes against reference ones."""
+    matched_candidate = sum(
+        any(abs(c - r) <= tolerance for r in reference) for c in candidate
+    )
+    matched_reference = sum(
+        any(abs(c - r) <= tolerance for c in candidate) for r in reference
+    )
+    precision = matched_candidate / len(candidate) if candidate else 1.0
+    recall = matched_reference / len(reference) if reference else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def compare_backbones(
+    video_path,
+    backbones=("resnet18", "mobilenet_v3_small", "resnet50_int8"),
+    reference=DEFAULT_BACKBONE,
+    alpha=1,
+    frame_per_minute=0,
+    tolerance=1.0,
+    **kwargs,
+):
+    """
+    Compares backbones against a reference on the same video.
+
+    Every backbone runs the full similarity pass without the cache; the report holds
+    its throughput and how well its scene changes agree with the reference backbone's.
+
+    Args:
+        video_path (str): The path to the video file.
+        backbones (tuple, optional): The backbone names to compare.
+        reference (str, optional): The reference backbone. Defaults to "resnet50".
+        alpha (float, optional): Passed to the scene change rule. Defaults to 1.
+        frame_per_minute (float, optional): Passed to the scene change rule. Defaults to 0.
+        tolerance (float, optional): Seconds two scene changes may differ and still match.
+            Defaults to 1.0.
+        **kwargs: Passed on to `iter_similarities`.
+
+    Returns:
+        list: One dict per backbone (reference first) with name, frames, seconds,
+            frames_per_sec, speedup, scene_changes, precision, recall and f1.
+    """
+    kwargs["cache"] = False
+    sample_rate = kwargs.get("sample_rate", DEFAULT_SAMPLE_RATE)
+    report = []
+    reference_changes = None
+    reference_seconds = None
+    for name in (reference,) + tuple(b for b in backbones if b != reference):
+        get_backbone(name)  # Keep model construction out of the timing
+        start = time.perf_counter()
+        similarities = calculate_similarities_parallel(video_path, backbone=name, **kwargs)
+        seconds = time.perf_counter() - start
+        scene_changes = scene_changes_from_similarities(
+            similarities, alpha, frame_per_minute, sample_rate
+        )
+        if reference_changes is None:
+            reference_changes, reference_seconds = scene_changes, seconds
+        precision, recall, f1 = _scene_change_agreement(
+            scene_changes, reference_changes, tolerance
+        )
+        frames = len(similarities) + 1
+        report.append(
+            {
+                "name": name,
+                "frames": frames,
+                "seconds": seconds,
+                "frames_per_sec": frames / seconds if seconds else float("inf"),
+                "speedup": reference_seconds / seconds if seconds else float("inf"),
+                "scene_changes": len(scene_changes),
+                "precision": precision,
+                "recall": recall,
+                "f1": f1,
+            }
+        )
+        logger.info(
+            f"{name}: {frames / seconds:.1f} frames/sec, "
+            f"{reference_seconds / seconds:.2f}x vs {reference}, "
+            f"{len(scene_changes)} scene changes, F1 {f1:.2f}"
+        )
+    return report
+
+
+class OnlineSceneDetector:
+    """
+    Decides scene changes one similarity at a time with constant memory.
+
+    Uses the same rules as `detect_scene_changes`, but with running statistics instead
+    of statistics over the whole video: the mean and standard deviation are tracked
+    with Welford's algorithm, and the frame_per_minute percentile over a rolling window
+    of the most recent samples. The first `warmup` samples are held back until the
+    statistics have settled and are then decided in one go.
+
+    Args:
+        alpha (float, optional): The number of standard deviations below the running mean
+            to consider as a scene change. Defaults to 0.
+        frame_per_minute (float, optional): The number of frames per minute to consider as
+            a scene change, 0 disables the percentile rule. Defaults to 0.
+        sample_rate (float, optional): Samples per second. Defaults to 1.0.
+        window (int, optional): Samples in the rolling percentile window. Defaults to 600.
+        warmup (int, optional): Samples held back before the first decision. Defaults to 60.
+    """
+
+    def __init__(
+        self,
+        alpha=0,
+        frame_per_minute=0,
+        sample_rate=DEFAULT_SAMPLE_RATE,
+        window=ONLINE_WINDOW,
+        warmup=ONLINE_WARMUP,
+    ):
+        assert window >= 1, "window must be at least 1"
+        self.alpha = alpha
+        self.percentile_rank = min(
+            100, round(100 * frame_per_minute / (60 * sample_rate))
+        )
+        self.warmup = warmup
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._window = deque(maxlen=window)
+        self._sorted_window = []
+        self._pending = []
+
+    @property
+    def std(self):
+        return (self._m2 / self.count) ** 0.5 if self.count else 0.0
+
+    def _percentile(self):
+        # Linear interpolation, the same as np.percentile's default
+        values = self._sorted_window
+        rank = self.percentile_rank / 100 * (len(values) - 1)
+        lower = int(rank)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+    def _is_scene_change(self, sim):
+        if sim <= self.mean - self.alpha * self.std:
+            return True
+        return self.percentile_rank > 0 and sim <= self._percentile()
+
+    def update(self, timestamp, sim):
+        """
+        Adds one similarity score.
+
+        Returns:
+            list: The scene changes decided by this sample, usually empty or one time point;
+                the whole warmup backlog is returned when it is released.
+        """
+        self.count += 1
+        delta = sim - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (sim - self.mean)
+
+        if len(self._window) == self._window.maxlen:
+            self._sorted_window.pop(bisect_left(self._sorted_window, self._window[0]))
+        self._window.append(sim)
+        insort(self._sorted_window, sim)
+
+        self._pending.append((timestamp, sim))
+        if self.count < self.warmup:
+            return []
+        return self.flush()
+
+    def flush(self):
+        """Decides every held back sample with the current statistics."""
+        pending, self._pending = self._pending, []
+        return [
+            timestamp for timestamp, sim in pending if self._is_scene_change(sim)
+        ]
+
+
+def iter_scene_changes(
+    video_path,
+    alpha=0,
+    frame_per_minute=0,
+    window=ONLINE_WINDOW,
+    warmup=ONLINE_WARMUP,
+    **kwargs,
+):
+    """
+    Yields scene changes while the video is still being scanned.
+
+    The streaming counterpart of `detect_scene_changes`: similarities are produced batch
+    by batch and judged by an `OnlineSceneDetector`, so memory stays constant for very
+    long videos and consumers can act on the first scene changes right away. Because the
+    statistics are running rather than global, the result can differ slightly from
+    `detect_scene_changes` on the same video.
+
+    Args:
+        video_path (str): The path to the video file.
+        alpha (float, optional): See `OnlineSceneDetector`. Defaults to 0.
+        frame_per_minute (float, optional): See `OnlineSceneDetector`. Defaults to 0.
+        window (int, optional): Samples in the rolling percentile window. Defaults to 600.
+        warmup (int, optional): Samples held back before the first decision. Defaults to 60.
+        **kwargs: Passed on to `iter_similarities`.
+
+    Yields:
+        The time points (in seconds) where scene changes occur.
+    """
+    assert os.path.isfile(video_path), f"{video_path} does not exist"
+
+    detector = OnlineSceneDetector(
+        alpha,
+        frame_per_minute,
+        kwargs.get("sample_rate", DEFAULT_SAMPLE_RATE),
+        window,
+        warmup,
+    )
+    for timestamp, sim in iter_similarities(video_path, **kwargs):
+        yield from detector.update(timestamp, sim)
+    yield from detector.flush()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compare scene detection backbones on a video"
+    )
+    parser.add_argument("video_path", type=str, help="video to run scene detection on")
+    parser.add_argument(
+        "--backbones",
+        type=str,
+        nargs="+",
+        default=["resnet18", "mobilenet_v3_small", "resnet50_int8"],
+        help="backbones to compare, see get_backbone",
+    )
+    parser.add_argument(
+        "--reference", type=str, default=DEFAULT_BACKBONE, help="reference backbone"
+    )
+    parser.add_argument("--alpha", type=float, default=1, help="scene change alpha")
+    parser.add_argument(
+        "--tolerance", type=float, default=1.0, help="seconds for matching scene changes"
+    )
+    args = parser.parse_args()
+
+    rows = compare_backbones(
+        args.video_path,
+        tuple(args.backbones),
+        args.reference,
+        alpha=args.alpha,
+        tolerance=args.tolerance,
+    )
+    print(f"{'backbone':<28}{'frames/s':>10}{'speedup':>9}{'scenes':>8}{'F1':>7}")
+    for row in rows:
+        print(
+            f"{row['name']:<28}{row['frames_per_sec']:>10.1f}{row['speedup']:>9.2f}"
+            f"{row['scene_changes']:>8}{row['f1']:>7.2f}"
+        )
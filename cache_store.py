@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+from logger import logger
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "YOUTUBESCRIPT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "youtubescript"),
+)
+
+# Bytes hashed per sampled chunk when fingerprinting a media file
+FINGERPRINT_CHUNK_SIZE = 1 << 20
+FINGERPRINT_CHUNKS = 16
+
+
+def file_fingerprint(path, chunk_size=FINGERPRINT_CHUNK_SIZE, chunks=FINGERPRINT_CHUNKS):
+    """
+    Computes a content fingerprint of a (possibly very large) media file.
+
+    The file size and `chunks` evenly spaced chunks of the file are hashed, so the
+    fingerprint follows the content rather than the file name and costs a few
+    milliseconds even for multi-gigabyte videos. Files smaller than the sampled
+    area are hashed in full.
+
+    Args:
+        path (str): The path to the file.
+        chunk_size (int, optional): Bytes read per chunk. Defaults to 1 MiB.
+        chunks (int, optional): The number of chunks sampled. Defaults to 16.
+
+    Returns:
+        str: A hex digest identifying the file content.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= chunk_size * chunks:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                digest.update(block)
+        else:
+            step = (size - chunk_size) // (chunks - 1)
+            for i in range(chunks):
+                f.seek(i * step)
+                digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+
+def make_key(*parts):
+    """Builds a cache key from the given parts, any change in a part gives a new key."""
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class DiskCache:
+    """
+    A directory of cache files with a size cap and least-recently-used eviction.
+
+    Every entry is a single file named after its key. Reading an entry refreshes its
+    modification time, and storing one evicts the oldest entries until the directory
+    fits into `max_bytes` again.
+
+    Args:
+        namespace (str): Subdirectory of `cache_dir` holding this cache.
+        max_bytes (int): The size cap for the whole namespace.
+        cache_dir (str, optional): The root cache directory. Defaults to
+            $YOUTUBESCRIPT_CACHE_DIR or ~/.cache/youtubescript.
+    """
+
+    def __init__(self, namespace, max_bytes, cache_dir=None):
+        self.directory = os.path.join(cache_dir or DEFAULT_CACHE_DIR, namespace)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, key, suffix=""):
+        """Returns the file path an entry with this key is stored at."""
+        return os.path.join(self.directory, f"{key}{suffix}")
+
+    def get(self, key, suffix=""):
+        """
+        Looks up an entry.
+
+        Returns:
+            str: The path of the cached file, or None on a miss.
+        """
+        path = self.path(key, suffix)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, write, suffix=""):
+        """
+        Stores an entry and evicts old entries if the cache grew over its cap.
+
+        Args:
+            key (str): The cache key.
+            write (callable): Called with a temporary path to write the entry to; the file
+                is moved into place atomically once it has been written.
+            suffix (str, optional): The file extension of the entry.
+
+        Returns:
+            str: The path of the cached file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key, suffix)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits into max_bytes."""
+        with self._lock:
+            try:
+                names = os.listdir(self.directory)
+            except FileNotFoundError:
+                return
+            entries = []
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+                logger.debug(f"cache evicted {name} from {self.directory}")
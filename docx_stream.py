@@ -0,0 +1,220 @@
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+import docx
+from docx.image.image import Image
+from logger import logger
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(docx.__file__), "templates", "default.docx")
+
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS_PART = "word/_rels/document.xml.rels"
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+HYPERLINK_RELATIONSHIP = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink"
+)
+IMAGE_RELATIONSHIP = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+)
+IMAGE_CONTENT_TYPES = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png"}
+
+EMU_PER_CM = 360000
+# document.xml is handed to the zip stream in chunks of about this many characters
+FLUSH_CHARS = 1 << 16
+
+DOCUMENT_HEAD = (
+    "<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    ' xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+    ' xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"'
+    ' xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"'
+    ' xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    "<w:body>"
+)
+PICTURE_XML = (
+    '<w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0">'
+    '<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{id}" name="Picture {id}"/>'
+    '<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="{name}"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"/></pic:spPr></pic:pic></a:graphicData></a:graphic>'
+    "</wp:inline></w:drawing></w:r>"
+)
+
+# Characters XML 1.0 cannot hold; python-docx refuses them, here they are dropped
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def _run_content(text):
+    """Converts text to run content, with line breaks and tabs like python-docx's run.text."""
+    parts = []
+    for i, line in enumerate(_INVALID_XML_CHARS.sub("", text).split("\n")):
+        if i:
+            parts.append("<w:br/>")
+        for j, segment in enumerate(line.split("\t")):
+            if j:
+                parts.append("<w:tab/>")
+            if segment:
+                parts.append(f'<w:t xml:space="preserve">{escape(segment)}</w:t>')
+    return "".join(parts)
+
+
+class DocxStreamWriter:
+    """
+    Writes a docx file of text, hyperlinks and pictures without building a document tree.
+
+    document.xml is streamed into the zip as it is generated. Hyperlink relationships
+    get their IDs on first use and are deduplicated by URL, and the relationships,
+    media parts and content types are written once the body is complete. All other
+    parts come unchanged from python-docx's default template, so the result opens
+    with `docx.Document` like a file saved by python-docx.
+
+    Args:
+        output_file (str): The path of the docx file to write.
+        template (str, optional): The docx the styles and settings are copied from.
+            Defaults to python-docx's default template.
+    """
+
+    def __init__(self, output_file, template=TEMPLATE_PATH):
+        self.output_file = output_file
+        self._zip = zipfile.ZipFile(output_file, "w", zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile(template) as source:
+            for item in source.infolist():
+                if item.filename in (DOCUMENT_PART, DOCUMENT_RELS_PART, CONTENT_TYPES_PART):
+                    continue
+                self._zip.writestr(item, source.read(item.filename))
+            self._relationships = source.read(DOCUMENT_RELS_PART).decode("utf-8")
+            self._content_types = source.read(CONTENT_TYPES_PART).decode("utf-8")
+            self._section = re.search(
+                r"<w:sectPr.*</w:sectPr>",
+                source.read(DOCUMENT_PART).decode("utf-8"),
+                re.DOTALL,
+            ).group(0)
+
+        used_ids = [int(i) for i in re.findall(r'Id="rId(\d+)"', self._relationships)]
+        self._next_id = max(used_ids, default=0) + 1
+        self._hyperlinks = {}
+        self._new_relationships = []
+        self._media = []
+        self._chunks = []
+        self._chunk_chars = 0
+        self._paragraph_open = False
+        self._document = self._zip.open(DOCUMENT_PART, "w")
+        self._write(DOCUMENT_HEAD)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, xml):
+        self._chunks.append(xml)
+        self._chunk_chars += len(xml)
+        if self._chunk_chars >= FLUSH_CHARS:
+            self._flush()
+
+    def _flush(self):
+        self._document.write("".join(self._chunks).encode("utf-8"))
+        self._chunks = []
+        self._chunk_chars = 0
+
+    def _relate(self, relationship_type, target, external=False):
+        r_id = f"rId{self._next_id}"
+        self._next_id += 1
+        mode = ' TargetMode="External"' if external else ""
+        self._new_relationships.append(
+            f'<Relationship Id="{r_id}" Type="{relationship_type}" '
+            f"Target={quoteattr(target)}{mode}/>"
+        )
+        return r_id
+
+    def _ensure_paragraph(self):
+        if not self._paragraph_open:
+            self._write("<w:p>")
+            self._paragraph_open = True
+
+    def add_paragraph(self, text=""):
+        """Starts a new paragraph, optionally with a run of text."""
+        if self._paragraph_open:
+            self._write("</w:p>")
+            self._paragraph_open = False
+        self._ensure_paragraph()
+        if text:
+            self.add_text(text)
+
+    def add_text(self, text):
+        """Adds a run of text to the current paragraph; '\\n' becomes a line break."""
+        self._ensure_paragraph()
+        self._write(f"<w:r>{_run_content(text)}</w:r>")
+
+    def add_hyperlink(self, text, url):
+        """Adds a hyperlink; every distinct URL gets a single relationship."""
+        r_id = self._hyperlinks.get(url)
+        if r_id is None:
+            r_id = self._hyperlinks[url] = self._relate(
+                HYPERLINK_RELATIONSHIP, url, external=True
+            )
+        self._ensure_paragraph()
+        self._write(f'<w:hyperlink r:id="{r_id}"><w:r>{_run_content(text)}</w:r></w:hyperlink>')
+
+    def add_picture(self, blob, width_cm):
+        """
+        Adds an inline picture scaled to the given width.
+
+        Args:
+            blob (bytes): The encoded JPEG or PNG image.
+            width_cm (float): The width the picture is shown at.
+        """
+        image = Image.from_blob(blob)
+        number = len(self._media) + 1
+        name = f"image{number}.{image.ext}"
+        self._media.append((f"word/media/{name}", blob))
+        r_id = self._relate(IMAGE_RELATIONSHIP, f"media/{name}")
+
+        cx = round(width_cm * EMU_PER_CM)
+        cy = round(cx * image.px_height / image.px_width)
+        self._ensure_paragraph()
+        self._write(PICTURE_XML.format(cx=cx, cy=cy, id=number, name=name, rid=r_id))
+
+    def close(self):
+        """Finishes document.xml and writes the media, relationships and content types."""
+        if self._zip is None:
+            return
+        if self._paragraph_open:
+            self._write("</w:p>")
+        self._write(f"{self._section}</w:body></w:document>")
+        self._flush()
+        self._document.close()
+
+        for partname, blob in self._media:
+            # Already compressed images gain nothing from deflate
+            self._zip.writestr(partname, blob, compress_type=zipfile.ZIP_STORED)
+        self._zip.writestr(
+            DOCUMENT_RELS_PART,
+            self._relationships.replace(
+                "</Relationships>",
+                "".join(self._new_relationships) + "</Relationships>",
+            ),
+        )
+        self._zip.writestr(CONTENT_TYPES_PART, self._content_types_xml())
+        self._zip.close()
+        self._zip = None
+        logger.debug(
+            f"streamed {self.output_file}: {len(self._hyperlinks)} hyperlink targets, "
+            f"{len(self._media)} pictures"
+        )
+
+    def _content_types_xml(self):
+        defaults = []
+        for extension in sorted({partname.rsplit(".", 1)[1] for partname, _ in self._media}):
+            if f'Extension="{extension}"' not in self._content_types:
+                defaults.append(
+                    f'<Default Extension="{extension}" '
+                    f'ContentType="{IMAGE_CONTENT_TYPES[extension]}"/>'
+                )
+        return self._content_types.replace("<Override ", "".join(defaults) + "<Override ", 1)
@@ -0,0 +1,157 @@
+import shutil
+import subprocess
+import pytest
+import torch
+import SceneExtractor
+
+FPS = "30000/1001"
+CUT_FRAME = 121  # 4.037 s, between the 1 sample/sec slots 4 and 5
+FRAME_STEP = 4
+
+needs_ffmpeg = pytest.mark.skipif(
+    shutil.which(SceneExtractor.FFMPEG_BINARY) is None, reason="ffmpeg not found"
+)
+
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    """
+    An 8 s NTSC clip: the top rows encode the frame number in their brightness, the
+    bottom rows are dark before CUT_FRAME and bright after it.
+    """
+    path = str(tmp_path_factory.mktemp("scene") / "clip.mp4")
+    luma = (
+        f"if(lt(Y,32),16+{FRAME_STEP}*mod(N,50),if(lt(N,{CUT_FRAME}),16,235))"
+    )
+    subprocess.run(
+        [
+            SceneExtractor.FFMPEG_BINARY,
+            "-nostdin",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"color=c=black:s=64x64:r={FPS}:d=8,format=yuv420p,"
+            f"geq=lum='{luma}':cb=128:cr=128",
+            "-c:v",
+            "libx264",
+            "-qp",
+            "0",
+            path,
+        ],
+        check=True,
+    )
+    return path
+
+
+def _samples(batches):
+    """Reads back (time, frame number mod 50, after the cut) for every sampled frame."""
+    samples = []
+    for timestamps, frames in batches:
+        for timestamp, frame in zip(timestamps, frames):
+            luma = frame[:90].mean() * 219 / 255 + 16
+            samples.append(
+                (
+                    timestamp,
+                    round((luma - 16) / FRAME_STEP),
+                    bool(frame[140:].mean() > 128),
+                )
+            )
+    return samples
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize(
+    "sample_rate, start_slot", [(1.0, 0), (3.0, 0), (1.0, 3), (3.0, 7), (0.5, 0)]
+)
+def test_ffmpeg_source_picks_the_grid_frames(clip, sample_rate, start_slot):
+    grid = _samples(
+        SceneExtractor.read_frame_batches(
+            clip, 8, sample_rate, "grid", start_slot=start_slot
+        )
+    )
+    ffmpeg = _samples(
+        SceneExtractor.read_frame_batches_ffmpeg(
+            clip, 8, sample_rate, start_slot=start_slot
+        )
+    )
+    assert grid
+    assert ffmpeg == grid
+
+
+@needs_ffmpeg
+def test_ffmpeg_source_sees_the_cut_in_the_next_slot(clip):
+    samples = _samples(SceneExtractor.read_frame_batches_ffmpeg(clip, 8, 1.0))
+    # Slot 4 starts at 4.0 s, before the cut, so the first frame after it is in slot 5
+    assert [timestamp for timestamp, _, after_cut in samples if after_cut][0] == 5
+
+
+@needs_ffmpeg
+def test_ffmpeg_source_can_be_closed_early(clip):
+    batches = SceneExtractor.read_frame_batches_ffmpeg(clip, 2, 3.0)
+    next(batches)
+    # Kills ffmpeg mid-stream, which must not be reported as a failure
+    batches.close()
+
+
+@needs_ffmpeg
+def test_ffmpeg_source_reports_errors(tmp_path):
+    missing = str(tmp_path / "missing.mp4")
+    with pytest.raises(RuntimeError, match="ffmpeg failed"):
+        list(SceneExtractor.read_frame_batches_ffmpeg(missing))
+
+
+def _tiny_backbone():
+    # Small and random, but deterministic; not registered, so workers get it pickled
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3, stride=2), torch.nn.AdaptiveAvgPool2d(1)
+    )
+    return SceneExtractor.Backbone("tiny", model, 32, 8)
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("frame_source", ["opencv", "ffmpeg"])
+def test_sharded_similarities_match_a_single_process(clip, frame_source):
+    backbone = _tiny_backbone()
+    options = dict(
+        batch_size=2,
+        sample_rate=3.0,
+        frame_source=frame_source,
+        cache=False,
+        backbone=backbone,
+    )
+
+    single = SceneExtractor.calculate_similarities_parallel(
+        clip, shards=1, sampling="grid", **options
+    )
+    # "grab" cannot start mid-video, the shards sample on the grid instead
+    sharded = SceneExtractor.calculate_similarities_parallel(
+        clip, shards=3, sampling="grab", **options
+    )
+
+    assert len(single) == 23
+    assert [t for t, _ in sharded] == [t for t, _ in single]
+    assert [sim for _, sim in sharded] == pytest.approx([sim for _, sim in single])
+
+
+@needs_ffmpeg
+def test_similarity_series_is_cached_from_disk(clip, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        SceneExtractor,
+        "similarity_cache",
+        SceneExtractor.DiskCache("scene_similarities", 1 << 20, cache_dir=str(tmp_path)),
+    )
+    options = dict(
+        batch_size=4, sample_rate=3.0, sampling="grid", backbone=_tiny_backbone()
+    )
+
+    uncached = list(SceneExtractor.iter_similarities(clip, cache=False, **options))
+    first = list(SceneExtractor.iter_similarities(clip, **options))
+    # The second run reads the series the first one spooled to the cache
+    monkeypatch.setattr(SceneExtractor, "iter_frame_batches", None)
+    second = list(SceneExtractor.iter_similarities(clip, **options))
+
+    assert first == uncached
+    assert second == uncached
@@ -0,0 +1,69 @@
+import numpy as np
+from STT_module import (
+    SAMPLE_RATE,
+    WHISPER_PARAMETERS,
+    estimate_model_bytes,
+    plan_vad_split,
+)
+
+
+def test_estimate_model_bytes_finds_the_variant_anywhere_in_the_name():
+    expected = {
+        "tiny.en": "tiny",
+        "medium": "medium",
+        "large-v3": "large",
+        "Systran/faster-whisper-small.en": "small",
+        "turbo": "turbo",
+        "large-v3-turbo": "turbo",
+        "deepdml/faster-whisper-large-v3-turbo-ct2": "turbo",
+        "distil-large-v3": "distil-large",
+        "Systran/faster-distil-whisper-medium.en": "distil-medium",
+        "distil-small.en": "distil-small",
+    }
+    for size, key in expected.items():
+        assert estimate_model_bytes(size, "float16") == int(
+            WHISPER_PARAMETERS[key] * 2
+        ), size
+    assert estimate_model_bytes("large-v3-turbo", "int8") == int(809e6)
+
+
+def _silence(seconds):
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+
+
+def _speech(*segments):
+    """get_speech_timestamps output for (start, end) segments in seconds."""
+    return [
+        {"start": int(start * SAMPLE_RATE), "end": int(end * SAMPLE_RATE)}
+        for start, end in segments
+    ]
+
+
+def _lengths(plan):
+    return [round(end - start, 3) for start, end in plan]
+
+
+def test_plan_vad_split_cuts_in_the_pause_nearest_the_target():
+    # A pause every 62 s; the targets of 4 pieces are 155, 310 and 465 s
+    speech = _speech(*((62 * i + 1, 62 * (i + 1) - 1) for i in range(10)))
+    plan = plan_vad_split(_silence(620), 4, speech=speech)
+
+    assert [start for start, _ in plan] == [0.0, 124.0, 310.0, 434.0]
+    assert _lengths(plan) == [124.0, 186.0, 124.0, 186.0]
+
+
+def test_plan_vad_split_skips_pauses_that_leave_a_short_piece():
+    # 200 s pieces; the pause at 355 s is close to its target (400 s) but only 110 s
+    # after the first cut, and nothing is near the last target (600 s)
+    speech = _speech((0, 244), (246, 354), (356, 800))
+    plan = plan_vad_split(_silence(800), 4, speech=speech)
+
+    assert _lengths(plan) == [245.0, 155.0, 200.0, 200.0]
+    assert min(_lengths(plan)) >= 120
+
+
+def test_plan_vad_split_without_pauses_cuts_equal_pieces():
+    plan = plan_vad_split(_silence(620), 4, speech=[])
+    assert _lengths(plan) == [155.0, 155.0, 155.0, 155.0]
+    # Short audio gets fewer pieces rather than pieces under the minimum
+    assert len(plan_vad_split(_silence(300), 4, speech=[])) == 2
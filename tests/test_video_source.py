@@ -0,0 +1,91 @@
+import json
+import shutil
+import subprocess
+import pytest
+import webvtt
+import video_source
+from video_source import YtDlpDriver, get_driver, match_language, metadata_language
+
+VTT = "WEBVTT\n\n00:00:00.000 --> 00:00:01.000\nhello\n"
+
+
+@pytest.fixture
+def fixtures(tmp_path):
+    fixture_dir = tmp_path / "fixtures"
+    fixture_dir.mkdir()
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    return fixture_dir, output_dir
+
+
+def test_chat_replay_is_not_a_subtitle_language(fixtures):
+    fixture_dir, output_dir = fixtures
+    (fixture_dir / "stream.mp4").write_bytes(b"")
+    (fixture_dir / "stream.live_chat.vtt").write_text('{"replayChatItemAction": {}}')
+    driver = YtDlpDriver(str(output_dir), fixture_dir=str(fixture_dir))
+
+    metadata = driver.probe("fixture:stream")
+
+    assert metadata["subtitles"] == []
+    assert metadata_language(metadata) is None
+
+
+def test_metadata_language_falls_back_to_the_only_subtitle(fixtures):
+    fixture_dir, output_dir = fixtures
+    (fixture_dir / "talk.mp4").write_bytes(b"")
+    (fixture_dir / "talk.de.vtt").write_text(VTT)
+    (fixture_dir / "talk.live_chat.vtt").write_text("{}")
+    driver = YtDlpDriver(str(output_dir), fixture_dir=str(fixture_dir))
+
+    assert metadata_language(driver.probe("fixture:talk")) == "de"
+
+
+def test_match_language():
+    assert match_language("zh", ["en", "zh-TW"]) == "zh-TW"
+    assert match_language("en-US", ["en"]) == "en"
+    assert match_language("fr", ["en"]) is None
+    assert video_source.LANGUAGE_TAG.fullmatch("live_chat") is None
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not found")
+def test_probe_download_and_subtitles_offline(fixtures, monkeypatch):
+    fixture_dir, output_dir = fixtures
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-nostdin",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc=size=64x64:rate=10:duration=2",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=duration=2",
+            "-shortest",
+            str(fixture_dir / "talk.mp4"),
+        ],
+        check=True,
+    )
+    (fixture_dir / "talk.en.vtt").write_text(VTT)
+    (fixture_dir / "talk.json").write_text(json.dumps({"title": "A talk"}))
+    monkeypatch.setattr(video_source, "FIXTURE_DIR", str(fixture_dir))
+    driver = get_driver(str(output_dir))
+
+    metadata = driver.probe("fixture:talk")
+    assert metadata["filename"] == "A talk"
+    assert metadata["subtitles"] == ["en"]
+    language = metadata_language(metadata)
+    assert language == "en"
+
+    downloads = driver.download(
+        metadata, subtitle_languages=[match_language(language, metadata["subtitles"])]
+    )
+
+    assert downloads["video"] == str(output_dir / "A talk.mp4")
+    assert downloads["audio"] == str(output_dir / "A talk.mp3")
+    assert (output_dir / "A talk.mp3").stat().st_size > 0
+    assert downloads["subtitles"] == {"en": str(output_dir / "A talk.en.vtt")}
+    assert [c.text for c in webvtt.read(downloads["subtitles"]["en"])] == ["hello"]
@@ -17,7 +17,11 @@ class Args:
         timestamp_content,
         output_dir,
         pic_embed, 
-        TTS_create 
+        TTS_create,
+        output_format="docx",
+        stt_workers=1,
+        stt_batch_size=0,
+        scene_shards=1,
     ):
         self.link = link
         self.prompt = prompt
@@ -28,6 +32,10 @@ class Args:
         self.output_dir = output_dir
         self.pic_embed = pic_embed
         self.TTS_create = TTS_create
+        self.output_format = output_format
+        self.stt_workers = stt_workers
+        self.stt_batch_size = stt_batch_size
+        self.scene_shards = scene_shards
 
 
 
@@ -38,6 +46,7 @@ def submit():
     whisper_model_size = whisper_model_size_var.get()
     pic_embed = pic_embed_var.get()
     TTS_create = TTS_create_var.get()
+    output_format = output_format_var.get()
     model_name = model_name_entry.get() or "auto"
     timestamp_content = timestamp_content_var.get()
     output_dir = filedialog.askdirectory()  # Ask for directory
@@ -55,7 +64,8 @@ def submit():
         timestamp_content,
         output_dir,
         pic_embed, 
-        TTS_create
+        TTS_create,
+        output_format,
     )
 
 
@@ -133,6 +143,14 @@ TTS_create_var.set(boolean_options[0])  # default value
 TTS_create_optionmenu = tk.OptionMenu(root, TTS_create_var, *boolean_options)
 TTS_create_optionmenu.pack()
 
+output_format_label = tk.Label(root, text="Output Format")
+output_format_label.pack()
+output_format_options = ["docx", "markdown", "html", "jsonl"]
+output_format_var = tk.StringVar(root)
+output_format_var.set(output_format_options[0])  # default value
+output_format_optionmenu = tk.OptionMenu(root, output_format_var, *output_format_options)
+output_format_optionmenu.pack()
+
 submit_button = tk.Button(root, text="Output Folder", command=submit)
 submit_button.pack()
 
@@ -17,7 +17,11 @@ class Args:
     timestamp_content,
     output_dir,
     pic_embed, 
-    TTS_create 
+    TTS_create,
+    output_format="docx",
+    stt_workers=1,
+    stt_batch_size=0,
+    scene_shards=1,
     ):
         self.link = link
         self.prompt = prompt
@@ -29,6 +33,10 @@ class Args:
         self.output_dir = output_dir
         self.pic_embed = pic_embed
         self.TTS_create = TTS_create
+        self.output_format = output_format
+        self.stt_workers = stt_workers
+        self.stt_batch_size = stt_batch_size
+        self.scene_shards = scene_shards
 
 class Worker(QThread):
     log_message = pyqtSignal(str)
@@ -146,6 +154,12 @@ class AppDemo(QWidget):
         self.layout.addWidget(QLabel('TTS Create'))
         self.layout.addWidget(self.TTS_create_combobox)
 
+        self.output_format_options = ["docx", "markdown", "html", "jsonl"]
+        self.output_format_combobox = QComboBox()
+        self.output_format_combobox.addItems(self.output_format_options)
+        self.layout.addWidget(QLabel('Output Format'))
+        self.layout.addWidget(self.output_format_combobox)
+
         
         self.output_dir_entry = QLineEdit()
         desktop_path = os.path.join(os.path.join(os.environ['USERPROFILE']), 'Desktop')
@@ -163,10 +177,10 @@ class AppDemo(QWidget):
         
 
 
-        self.queue_table = QTableWidget(0, 12)  # 11 columns for each parameter and regist button
+        self.queue_table = QTableWidget(0, 13)  # 12 columns for each parameter and regist button
 
         self.queue_table.setHorizontalHeaderLabels([
-            'Status', 'Link', 'Prompt','LLM format', 'Language', 'Whisper Model Size', 'Model Name', 'Timestamp Content', 'Pic Embed', 'TTS Create', 'Output Folder','Delete'
+            'Status', 'Link', 'Prompt','LLM format', 'Language', 'Whisper Model Size', 'Model Name', 'Timestamp Content', 'Pic Embed', 'TTS Create', 'Output Format', 'Output Folder','Delete'
         ])
         self.layout.addWidget(self.queue_table)
 
@@ -215,6 +229,7 @@ class AppDemo(QWidget):
         timestamp_content = self.timestamp_content_combobox.currentText()
         pic_embed = self.pic_embed_combobox.currentText()
         TTS_create = self.TTS_create_combobox.currentText()
+        output_format = self.output_format_combobox.currentText()
         output_dir = self.output_dir_entry.text()
         delete_button = QPushButton('Delete')
         delete_button.clicked.connect(self.delete_row)
@@ -231,8 +246,9 @@ class AppDemo(QWidget):
         self.queue_table.setItem(row, 7, QTableWidgetItem(timestamp_content))
         self.queue_table.setItem(row, 8, QTableWidgetItem(pic_embed))
         self.queue_table.setItem(row, 9, QTableWidgetItem(TTS_create))
-        self.queue_table.setItem(row, 10, QTableWidgetItem(output_dir))
-        self.queue_table.setCellWidget(row, 11, delete_button)
+        self.queue_table.setItem(row, 10, QTableWidgetItem(output_format))
+        self.queue_table.setItem(row, 11, QTableWidgetItem(output_dir))
+        self.queue_table.setCellWidget(row, 12, delete_button)
         self.queue_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
 
     def add_log_message_to_table(self, messages):
@@ -255,7 +271,8 @@ class AppDemo(QWidget):
         timestamp_content = self.queue_table.item(row, 7).text()
         pic_embed = self.queue_table.item(row, 8).text()
         TTS_create = self.queue_table.item(row, 9).text()
-        output_dir = self.queue_table.item(row, 10).text()
+        output_format = self.queue_table.item(row, 10).text()
+        output_dir = self.queue_table.item(row, 11).text()
         args = Args(
             link,
             prompt,
@@ -266,7 +283,8 @@ class AppDemo(QWidget):
             timestamp_content,
             output_dir,
             pic_embed, 
-            TTS_create
+            TTS_create,
+            output_format,
         )
         self.worker.set_args(args)
         self.loading_movie.start()
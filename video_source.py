@@ -0,0 +1,315 @@
+import json
+import os
+import pathlib
+import re
+import threading
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+from logger import logger
+
+# Downloads are named after the video title, like yt-dlp's own default
+OUTPUT_TEMPLATE = "%(title)s.%(ext)s"
+FIXTURE_SCHEME = "fixture:"
+# Serve `fixture:<id>` links from this directory, to run the pipeline offline
+FIXTURE_DIR = os.environ.get("YOUTUBESCRIPT_FIXTURE_DIR")
+# Subtitle keys are language tags, apart from extras such as YouTube's "live_chat"
+# (the JSON chat replay of a stream) which are not subtitles at all
+LANGUAGE_TAG = re.compile(r"[A-Za-z]{2,3}(-[A-Za-z0-9]{1,8})*")
+
+
+class FixtureIE(InfoExtractor):
+    """
+    Serves local media under `fixture:<id>` URLs, so downloads can be tested offline.
+
+    `<fixture_dir>/<id>.<ext>` is the media file, `<id>.<lang>.vtt` files become its
+    subtitles and an optional `<id>.json` adds metadata such as title or language.
+
+    Args:
+        fixture_dir (str): The directory holding the fixtures.
+    """
+
+    IE_NAME = "fixture"
+    _VALID_URL = r"fixture:(?P<id>[^/]+)"
+
+    def __init__(self, fixture_dir):
+        super().__init__()
+        self.fixture_dir = fixture_dir
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        media = None
+        subtitles = {}
+        metadata = {}
+        for name in sorted(os.listdir(self.fixture_dir)):
+            path = os.path.join(self.fixture_dir, name)
+            parts = name.split(".")
+            if parts[0] != video_id:
+                continue
+            if name == f"{video_id}.json":
+                with open(path, encoding="utf-8") as f:
+                    metadata = json.load(f)
+            elif len(parts) == 3 and parts[2] == "vtt":
+                subtitles[parts[1]] = [{"url": pathlib.Path(path).as_uri(), "ext": "vtt"}]
+            elif len(parts) == 2:
+                media = path
+        if media is None:
+            raise yt_dlp.utils.ExtractorError(f"no fixture media for {video_id}", expected=True)
+        return {
+            "id": video_id,
+            "title": video_id,
+            "url": pathlib.Path(media).as_uri(),
+            "ext": os.path.splitext(media)[1][1:],
+            "subtitles": subtitles,
+            **metadata,
+        }
+
+
+class YtDlpDriver:
+    """
+    Probes and downloads videos with yt-dlp's Python API inside this process.
+
+    One YoutubeDL is kept per set of options, so its extractors are initialized once and
+    reused for every video. Output paths are collected from yt-dlp's progress and
+    post-processor hooks while a download runs, so no caller has to look for the files.
+
+    Args:
+        output_dir (str): The directory downloads are saved to.
+        fixture_dir (str, optional): Serve `fixture:<id>` URLs from this directory,
+            see `FixtureIE`.
+        **params: Extra YoutubeDL parameters for every call.
+    """
+
+    def __init__(self, output_dir, fixture_dir=None, **params):
+        self.output_dir = output_dir
+        self.fixture_dir = fixture_dir
+        self._params = {"outtmpl": os.path.join(output_dir, OUTPUT_TEMPLATE), **params}
+        if fixture_dir:
+            self._params["enable_file_urls"] = True
+        self._downloaders = {}
+        self._paths = None
+        self._lock = threading.Lock()
+
+    def _downloader(self, key, **options):
+        ydl = self._downloaders.get(key)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(
+                {
+                    **self._params,
+                    **options,
+                    "progress_hooks": [self._on_download],
+                    "postprocessor_hooks": [self._on_postprocess],
+                }
+            )
+            if self.fixture_dir:
+                ydl.add_info_extractor(FixtureIE(self.fixture_dir))
+            self._downloaders[key] = ydl
+        return ydl
+
+    def _ie_key(self, link):
+        return "Fixture" if self.fixture_dir and link.startswith(FIXTURE_SCHEME) else None
+
+    def _on_download(self, status):
+        if status["status"] != "finished" or self._paths is None:
+            return
+        info = status["info_dict"]
+        # Subtitle downloads carry a bare format dict; they are recorded with the media
+        if "id" not in info:
+            return
+        self._paths["video"] = status["filename"]
+        for language, subtitle in (info.get("requested_subtitles") or {}).items():
+            if subtitle.get("filepath"):
+                self._paths["subtitles"][language] = subtitle["filepath"]
+
+    def _on_postprocess(self, status):
+        if status["status"] != "finished" or self._paths is None:
+            return
+        if status["postprocessor"] == "Merger":
+            self._paths["video"] = status["info_dict"]["filepath"]
+        elif status["postprocessor"] == "MoveFiles":
+            # The last post-processor, it sees the file all others produced
+            self._paths["final"] = status["info_dict"]["filepath"]
+
+    def probe(self, link):
+        """
+        Fetches the metadata of a video without downloading anything.
+
+        The full info JSON is also saved to `<output_dir>/<title>.info.json`.
+
+        Args:
+            link (str): The video URL.
+
+        Returns:
+            dict: The video metadata:
+                title (str): The video title.
+                filename (str): The file name, without extension, downloads are saved under.
+                duration (float): The length in seconds, or None if unknown.
+                language (str): The language declared by the uploader, or None.
+                subtitles (list): Languages with uploaded subtitles; chat replays and
+                    other tracks that are not keyed by a language are left out.
+                automatic_captions (list): Languages with generated captions.
+                formats (list): The available formats as reported by yt-dlp.
+                info_file (str): The saved info JSON.
+                info (dict): The info JSON, which `download` processes again.
+        """
+        with self._lock:
+            ydl = self._downloader("probe", quiet=True, no_warnings=True)
+            info = ydl.extract_info(link, download=False, ie_key=self._ie_key(link))
+            # The file name yt-dlp will use, with the title sanitized for the file system
+            filename = os.path.splitext(os.path.basename(ydl.prepare_filename(info)))[0]
+            info = ydl.sanitize_info(info, remove_private_keys=True)
+
+        info_file = os.path.join(self.output_dir, f"{filename}.info.json")
+        with open(info_file, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+
+        metadata = {
+            "title": info.get("title"),
+            "filename": filename,
+            "duration": info.get("duration"),
+            "language": info.get("language"),
+            "subtitles": _languages(info.get("subtitles")),
+            "automatic_captions": _languages(info.get("automatic_captions")),
+            "formats": info.get("formats") or [],
+            "info_file": info_file,
+            "info": info,
+        }
+        logger.debug(
+            f"probed {link}: {metadata['title']!r}, {metadata['duration']} s, "
+            f"language {metadata['language']}, subtitles {metadata['subtitles']}, "
+            f"{len(metadata['formats'])} formats"
+        )
+        return metadata
+
+    def download(
+        self,
+        metadata,
+        audio_format="mp3",
+        keep_video=True,
+        subtitle_languages=(),
+        format_sort=(),
+    ):
+        """
+        Downloads a probed video, reusing its metadata instead of extracting it again.
+
+        Args:
+            metadata (dict): The result of `probe`.
+            audio_format (str, optional): Extract the audio to this format, or None to
+                skip the extraction. Defaults to "mp3".
+            keep_video (bool, optional): Keep the video next to the audio. Defaults to True.
+            subtitle_languages (tuple, optional): Uploaded subtitles to save as VTT.
+            format_sort (tuple, optional): yt-dlp format sorting, e.g. ("+size", "+br")
+                for the smallest file.
+
+        Returns:
+            dict: The exact output paths: video, audio (None if not kept or extracted)
+                and subtitles as {language: path}.
+        """
+        options = {
+            "format_sort": list(format_sort),
+            "keepvideo": keep_video,
+            "postprocessors": [
+                {"key": "FFmpegExtractAudio", "preferredcodec": audio_format}
+            ]
+            if audio_format
+            else [],
+        }
+        if subtitle_languages:
+            options.update(
+                writesubtitles=True,
+                subtitlesformat="vtt",
+                subtitleslangs=list(subtitle_languages),
+            )
+        key = json.dumps(options, sort_keys=True)
+
+        with self._lock:
+            ydl = self._downloader(key, **options)
+            self._paths = {"video": None, "final": None, "subtitles": {}}
+            try:
+                info = ydl.process_ie_result(dict(metadata["info"]), download=True)
+                paths = self._paths
+            finally:
+                self._paths = None
+
+        # Files that already existed are skipped without any hook, the result has them too
+        for download in info.get("requested_downloads") or []:
+            paths["video"] = paths["video"] or download.get("_filename")
+            paths["final"] = paths["final"] or download.get("filepath")
+        for language, subtitle in (info.get("requested_subtitles") or {}).items():
+            if subtitle.get("filepath"):
+                paths["subtitles"].setdefault(language, subtitle["filepath"])
+
+        result = {
+            "video": paths["video"] if keep_video or not audio_format else None,
+            "audio": paths["final"] if audio_format else None,
+            "subtitles": paths["subtitles"],
+        }
+        logger.info(f"downloaded {metadata['title']!r}: {result}")
+        return result
+
+
+def _languages(tracks):
+    return [key for key in tracks or {} if LANGUAGE_TAG.fullmatch(key)]
+
+
+def match_language(language, candidates):
+    """
+    Finds the entry of a language list that stands for the given language.
+
+    An exact match wins, otherwise the primary subtags are compared, so "zh" finds
+    "zh-TW" and "en-US" finds "en".
+
+    Returns:
+        str: The matching candidate, or None.
+    """
+    if not language:
+        return None
+    candidates = list(candidates)
+    if language in candidates:
+        return language
+    primary = language.split("-")[0].lower()
+    return next((c for c in candidates if c.split("-")[0].lower() == primary), None)
+
+
+def metadata_language(metadata):
+    """
+    Resolves the spoken language of a video from its probed metadata alone.
+
+    The uploader's declared language comes first, then the original-language track of
+    the automatic captions ("<lang>-orig" on YouTube), then the only uploaded subtitle.
+
+    Args:
+        metadata (dict): The result of `YtDlpDriver.probe`.
+
+    Returns:
+        str: The language code, or None if the metadata does not tell.
+    """
+    if metadata["language"]:
+        return metadata["language"]
+    original = [
+        caption[: -len("-orig")]
+        for caption in metadata["automatic_captions"]
+        if caption.endswith("-orig")
+    ]
+    if len(original) == 1:
+        return original[0]
+    if len(metadata["subtitles"]) == 1:
+        return metadata["subtitles"][0]
+    return None
+
+
+_drivers = {}
+_drivers_lock = threading.Lock()
+
+
+def get_driver(output_dir, fixture_dir=None):
+    """
+    Returns the process-wide driver for an output directory, created on first use.
+
+    `fixture_dir` defaults to $YOUTUBESCRIPT_FIXTURE_DIR, see `FixtureIE`.
+    """
+    fixture_dir = fixture_dir or FIXTURE_DIR
+    with _drivers_lock:
+        key = (output_dir, fixture_dir)
+        if key not in _drivers:
+            _drivers[key] = YtDlpDriver(output_dir, fixture_dir=fixture_dir)
+        return _drivers[key]
@@ -1,14 +1,43 @@
-from datetime import datetime, timedelta, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import base64
+import html
+import json
+import re
 import docx
 from docx import Document
 from docx.shared import Cm
 from docx.oxml.ns import nsdecls
 from docx.oxml import parse_xml
 import webvtt
-from SceneExtractor import detect_scene_changes
 import cv2
+import numpy as np
+import os
+import tempfile
+import time
+from docx_stream import DocxStreamWriter
 from logger import logger
 
+# Output formats of vtt_to_file and the file extension of each
+TRANSCRIPT_FORMATS = {
+    "docx": ".docx",
+    "markdown": ".md",
+    "html": ".html",
+    "jsonl": ".jsonl",
+}
+
+# A paragraph is forced after this long without a scene change
+FALLBACK_PARAGRAPH_MS = 30000
+
+# Embedded frames are shown 15 cm wide; 960 px is about 160 dpi at that size
+PICTURE_WIDTH_CM = 15
+PICTURE_WIDTH_PX = 960
+PICTURE_JPEG_QUALITY = 85
+# Frame fetching decodes through gaps up to this many seconds and seeks past longer ones
+FRAME_SEEK_GAP = 10.0
+FRAME_SEEK_MARGIN = 1.0
+
 def timecode_to_seconds(timecode):
     """
     Converts a timecode string in the format 'HH:MM:SS' or 'MM:SS' or 'SS' to seconds.
@@ -38,6 +67,68 @@ def timecode_to_seconds(timecode):
     return int(hours * 3600 + minutes * 60 + seconds)
 
 
+def timestamp_to_ms(time_str):
+    """
+    Converts a caption timestamp in the format 'HH:MM:SS.sss' or 'MM:SS.sss' to milliseconds.
+
+    Args:
+        time_str (str): The timestamp to convert.
+
+    Returns:
+        int: The timestamp in milliseconds.
+    """
+    *parts, seconds = time_str.split(":")
+    minutes = 0
+    for part in parts:
+        minutes = minutes * 60 + int(part)
+    return minutes * 60000 + round(float(seconds) * 1000)
+
+
+def format_clock(ms):
+    """Formats milliseconds as 'HH:MM:SS', dropping the fraction of a second."""
+    seconds = int(ms) // 1000
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class CaptionTimeline:
+    """
+    Caption start and end times, parsed once into sorted NumPy arrays of milliseconds.
+
+    Paragraph and picture planning works on these arrays with np.searchsorted instead
+    of re-parsing the caption timestamps for every decision.
+
+    Args:
+        starts_ms (array-like): The caption start times in milliseconds, ascending.
+        ends_ms (array-like): The caption end times in milliseconds.
+    """
+
+    def __init__(self, starts_ms, ends_ms):
+        self.starts_ms = np.asarray(starts_ms, dtype=np.int64)
+        self.ends_ms = np.asarray(ends_ms, dtype=np.int64)
+
+    @classmethod
+    def from_content(cls, content):
+        """Builds the timeline of a content list as returned by `generate_content`."""
+        return cls(
+            [timestamp_to_ms(start) for _, _, start, _ in content],
+            [timestamp_to_ms(end) for _, _, _, end in content],
+        )
+
+    def __len__(self):
+        return len(self.starts_ms)
+
+    @property
+    def starts(self):
+        """The caption start times in seconds."""
+        return self.starts_ms / 1000
+
+
+def _as_timeline(content):
+    if isinstance(content, CaptionTimeline):
+        return content
+    return CaptionTimeline.from_content(content)
+
+
 def create_youtube_hyperlink(caption, link, format):
     """
     Creates a hyperlink to a YouTube video based on the given caption, video ID, and format.
@@ -45,7 +136,7 @@ def create_youtube_hyperlink(caption, link, format):
     Args:
         caption (Caption): The caption object containing the start, end, and text of the caption.
         link (str): The link of the YouTube video.
-        format (str): The format of the hyperlink. Supported formats: 'docx'.
+        format (str): The format of the hyperlink, one of TRANSCRIPT_FORMATS.
 
     Returns:
         tuple: A tuple containing the hyperlink text, URL, start time, and end time.
@@ -74,14 +165,15 @@ def create_youtube_hyperlink(caption, link, format):
     start, end, text = caption.start, caption.end, caption.text
     text = remove_spaces_from_text(text)
     total_seconds = timecode_to_seconds(start)
-    if format == "docx":
-        # For Word, we return the URL and text separately to create a hyperlink later
-        return (
-            text,
-            f"{link}&t={total_seconds}s",
-            start,
-            end,
-        )
+    if format not in TRANSCRIPT_FORMATS:
+        raise ValueError(f"Invalid format: {format}")
+    # Every format gets the URL and text separately and renders the link itself
+    return (
+        text,
+        f"{link}&t={total_seconds}s",
+        start,
+        end,
+    )
 
 
 def add_hyperlink(run, url, text):
@@ -124,83 +216,100 @@ def should_execute_action(
 
     Args:
         video_path (str): The path of the video file.
-        content (list): A list of tuples containing the text, URL, start time, and end time.
-        mode (str, optional): The mode of operation. 'time' for time difference, 'scene' for scene changes. Defaults to 'time'.
+        content (list or CaptionTimeline): The content tuples (text, URL, start time, end time) or their timeline.
         minutes_per_paragraph (float, optional): The maximum number of minutes per paragraph. Defaults to 0.5.
         alpha (float, optional): The sensitivity of the scene change detection. Defaults to 1.0.
 
     Returns:
-        list: A list of booleans indicating whether an action should be executed for each item in the content.
+        numpy.ndarray: A boolean array indicating whether an action should be executed for each item in the content.
     """
+    timeline = _as_timeline(content)
     should_execute_scene = determine_execution_from_scene(
-        video_path, content, alpha, frame_per_minute
+        video_path, timeline, alpha, frame_per_minute
     )
-    should_execute_time = determine_execution_from_time(content, minutes_per_paragraph)
+    should_execute_time = determine_execution_from_time(timeline, minutes_per_paragraph)
+    return should_execute_scene | should_execute_time
 
-    should_execute = [a or b for a, b in zip(should_execute_scene, should_execute_time)]
-    return should_execute
 
+def determine_execution_from_scene(
+    video_path, content, alpha, frame_per_minute, thumbnails=None, shards=1
+):
+    """
+    Marks the caption each scene change of the video falls on.
 
-def determine_execution_from_scene(video_path, content, alpha, frame_per_minute):
-    def align_timestamp(timestamp):
-        return datetime.fromtimestamp(timestamp) - timedelta(hours=8)
+    A scene change belongs to the first caption starting at or after it. When several
+    scene changes fall before the same caption they take the following captions, one
+    caption per scene change.
 
-    should_execute = []
-    scene_changes = detect_scene_changes(video_path, alpha, frame_per_minute)
+    Args:
+        video_path (str): The path of the video file.
+        content (list or CaptionTimeline): The content tuples or their timeline.
+        alpha (float): The sensitivity of the scene change detection.
+        frame_per_minute (int): The number of scene changes wanted per minute.
+        thumbnails (SceneThumbnails, optional): Collects the scene change frames during
+            detection; afterwards it holds one frame per marked caption, in order.
+        shards (int, optional): Processes the video is split across for scene
+            detection, see `SceneExtractor.calculate_similarities_sharded`. Defaults to 1.
 
-    logger.debug(f"scene_changes:{scene_changes}")
+    Returns:
+        numpy.ndarray: A boolean array, True for the captions a scene change falls on.
+    """
+    # Imported here so text-only jobs never load torch or the scene detection model
+    from SceneExtractor import detect_scene_changes
 
-    i = 0
-    for _, _, start, _ in content:
-        current_time = parse_time(start)  # Parse the current start time
-        if (current_time - align_timestamp(scene_changes[-1])) >= timedelta(minutes=0):
-            should_execute.append(False)
-        if i == len(scene_changes):
-            should_execute.append(False)
-            continue
-        if (current_time - align_timestamp(scene_changes[i])) >= timedelta(minutes=0):
-            i = i + 1
-            should_execute.append(True)
+    timeline = _as_timeline(content)
+    scene_changes = detect_scene_changes(
+        video_path, alpha, frame_per_minute, shards=shards, thumbnails=thumbnails
+    )
 
-        else:
-            should_execute.append(False)
+    logger.debug(f"scene_changes:{scene_changes}")
+
+    scene_ms = np.round(np.asarray(scene_changes, dtype=np.float64) * 1000)
+    first_caption = np.searchsorted(timeline.starts_ms, scene_ms, side="left")
+    # Push scene changes sharing a caption onto the next ones: slot_i = max(first_i, slot_i-1 + 1)
+    order = np.arange(len(first_caption))
+    slots = order + np.maximum.accumulate(first_caption - order)
+    in_range = slots < len(timeline)
+    should_execute = np.zeros(len(timeline), dtype=bool)
+    should_execute[slots[in_range]] = True
+    if thumbnails is not None:
+        thumbnails.select([t for t, keep in zip(scene_changes, in_range) if keep])
     return should_execute
 
+
 def basic_execute_pattern(content):
-    should_execute = []
-    for _, _, _, _ in content:
-        should_execute.append(False)
-    return should_execute
+    return np.zeros(len(content), dtype=bool)
+
 
 def determine_execution_from_boolean_list(boolean_list, content):
     """
     Determines the execution status for each item in a boolean list based on the start time of the corresponding content.
 
+    A False item becomes True when its caption starts more than 30 seconds after the
+    last item turned True this way, so no paragraph runs much longer than that.
+
     Args:
         boolean_list (list): A list of boolean values indicating whether each item should be executed.
-        content (list): A list of tuples containing the content information, where each tuple has the format (id, text, start, end).
+        content (list or CaptionTimeline): The content tuples or their timeline.
 
     Returns:
-        list: A list of boolean values indicating the execution status for each item.
+        numpy.ndarray: A boolean array indicating the execution status for each item.
 
     """
-    should_execute = []
-    last_true_time = 0  # Initialize
-
-    for i, (execute, (_, _, start, _)) in enumerate(zip(boolean_list, content)):
-        # Convert the start time of the caption to seconds
-        start_time = sum(
-            float(x) * 60**i for i, x in enumerate(reversed(start.split(":")))
-        )
-
-        if not execute and start_time - last_true_time > 30:
-            # If the current value is False and at least 30 seconds have passed since the last True,
-            # set the current value to True
-            should_execute.append(True)
-            last_true_time = start_time  # Update the last true timestamp
-        else:
-            should_execute.append(execute)
-
+    starts_ms = _as_timeline(content).starts_ms
+    should_execute = np.array(boolean_list, dtype=bool)[: len(starts_ms)]
+    starts_ms = starts_ms[: len(should_execute)]
+    free = np.flatnonzero(~should_execute)
+
+    last_true_time = 0
+    while True:
+        # The first False item starting more than 30 seconds after the last forced one
+        i = np.searchsorted(starts_ms, last_true_time + FALLBACK_PARAGRAPH_MS, side="right")
+        j = np.searchsorted(free, i)
+        if j == len(free):
+            break
+        should_execute[free[j]] = True
+        last_true_time = starts_ms[free[j]]
     return should_execute
 
 
@@ -209,127 +318,539 @@ def determine_execution_from_time(content, minutes_per_paragraph):
     Determines whether each paragraph in the content should be executed based on the time difference between paragraphs.
 
     Args:
-        content (list): A list of tuples representing the content, where each tuple contains the paragraph index, text, start time, and end time.
+        content (list or CaptionTimeline): The content tuples or their timeline.
         minutes_per_paragraph (int): The minimum number of minutes that should elapse between paragraphs.
 
     Returns:
-        list: A list of boolean values indicating whether each paragraph should be executed.
-    """
-    should_execute = []
-    start_time = parse_time(content[0][2])  # Parse the start time
-    for _, _, start, _ in content:
-        current_time = parse_time(start)  # Parse the current start time
-        if (current_time - start_time) >= timedelta(minutes=minutes_per_paragraph):
-            should_execute.append(True)
-            start_time = current_time
-        else:
-            should_execute.append(False)
+        numpy.ndarray: A boolean array indicating whether each paragraph should be executed.
+    """
+    starts_ms = _as_timeline(content).starts_ms
+    gap_ms = round(minutes_per_paragraph * 60000)
+    should_execute = np.zeros(len(starts_ms), dtype=bool)
+    if not len(starts_ms):
+        return should_execute
+
+    # Jump from paragraph to paragraph instead of visiting every caption
+    i = np.searchsorted(starts_ms, starts_ms[0] + gap_ms, side="left")
+    while i < len(starts_ms):
+        should_execute[i] = True
+        i = max(np.searchsorted(starts_ms, starts_ms[i] + gap_ms, side="left"), i + 1)
     return should_execute
 
 
-def add_frame_to_docx(cap, timestamp, para):
+def iter_frames_at(video_path, timestamps, seek_gap=FRAME_SEEK_GAP):
     """
-    Adds a frame from a video to a docx file.
+    Reads the frames shown at the given times in a single forward pass over the video.
+
+    Short gaps between pictures are decoded through with grab(), which skips the pixel
+    conversion of frames nobody wants; longer gaps jump forward with a seek that lands
+    a little early, so the decoder never has to go backwards.
 
     Args:
-        cap (cv2.VideoCapture): The video capture object.
-        timestamp (datetime.datetime): The timestamp of the desired frame.
-        para (docx.text.paragraph.Paragraph): The paragraph to which the frame will be added.
+        video_path (str): The path of the video file.
+        timestamps (iterable): The times in seconds, in ascending order.
+        seek_gap (float, optional): Seek instead of decoding through gaps longer than
+            this many seconds. Defaults to 10.
 
-    Returns:
-        docx.text.paragraph.Paragraph: The original Paragraph object with the added frame.
+    Yields:
+        tuple: The requested time and the frame (BGR numpy array), or None if the video
+            ends before that time.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    position = -1  # Index of the last grabbed frame
+    frame = None
+    try:
+        for timestamp in timestamps:
+            target = int(fps * timestamp)
+            if target - max(position, 0) > seek_gap * fps:
+                seek_seconds = max(0.0, target / fps - FRAME_SEEK_MARGIN)
+                cap.set(cv2.CAP_PROP_POS_MSEC, seek_seconds * 1000)
+                position = -1
+            while position < target:
+                if not cap.grab():
+                    break
+                position = int(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000 * fps + 1e-3)
+                frame = None
+            if position < target:
+                yield timestamp, None
+                continue
+            if frame is None:
+                ret, frame = cap.retrieve()
+                frame = frame if ret else None
+            yield timestamp, frame
+    finally:
+        cap.release()
+
+
+def encode_picture(frame, width=PICTURE_WIDTH_PX, picture_format="jpeg"):
     """
-    
-    # Convert timestamp to frame number
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    timestamp_seconds = timestamp.replace(tzinfo=timezone.utc).timestamp()
-    frame_number = int(fps * timestamp_seconds)
-    # Set the current frame position
-    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+    Downscales a frame to the width it is shown at and encodes it in memory.
 
-    # Read the frame
-    ret, frame = cap.read()
+    Args:
+        frame (numpy.ndarray): The BGR frame.
+        width (int, optional): The maximum width in pixels. Defaults to 960, about 160 dpi
+            at the 15 cm the pictures are shown at.
+        picture_format (str, optional): 'jpeg' or 'png'. Defaults to 'jpeg'.
+
+    Returns:
+        io.BytesIO: The encoded picture.
+    """
+    height, frame_width = frame.shape[:2]
+    if frame_width > width:
+        frame = cv2.resize(
+            frame, (width, round(height * width / frame_width)), interpolation=cv2.INTER_AREA
+        )
+    if picture_format == "jpeg":
+        ret, buffer = cv2.imencode(
+            ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, PICTURE_JPEG_QUALITY]
+        )
+    elif picture_format == "png":
+        ret, buffer = cv2.imencode(".png", frame)
+    else:
+        raise ValueError(f"Invalid picture format: {picture_format}")
     if not ret:
-        logger.debug("Failed to retrieve frame")
-        return
+        raise RuntimeError("Failed to encode frame")
+    return BytesIO(buffer.tobytes())
+
 
-    # Save the frame to a file
-    frame_file = "frame.png"
+def encode_pictures(video_path, timestamps, picture_format="jpeg", encode_workers=1):
+    """
+    Fetches and encodes the pictures for the given times.
+
+    Frames are read in one ordered pass; with encode_workers > 1 the resizing and
+    encoding runs on a thread pool (OpenCV releases the GIL) while decoding continues,
+    with a bounded number of frames in flight.
 
-    cv2.imwrite(frame_file, frame)
+    Args:
+        video_path (str): The path of the video file.
+        timestamps (list): The times in seconds, in ascending order.
+        picture_format (str, optional): 'jpeg' or 'png'. Defaults to 'jpeg'.
+        encode_workers (int, optional): The number of encoding threads. Defaults to 1.
+
+    Returns:
+        list: One io.BytesIO per timestamp, None where the frame could not be read.
+    """
+
+    if not len(timestamps):
+        return []
+
+    def encode(frame):
+        return None if frame is None else encode_picture(frame, picture_format=picture_format)
+
+    frames = iter_frames_at(video_path, timestamps)
+    if encode_workers <= 1:
+        return [encode(frame) for _, frame in frames]
+
+    pictures = []
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=encode_workers) as executor:
+        for _, frame in frames:
+            if len(in_flight) >= 2 * encode_workers:
+                pictures.append(in_flight.popleft().result())
+            in_flight.append(executor.submit(encode, frame))
+        pictures.extend(future.result() for future in in_flight)
+    return pictures
+
+
+def scene_pictures(video_path, scene_frames, picture_format="jpeg", encode_workers=1):
+    """
+    Turns the frames kept by scene detection into pictures, fetching only missing ones.
+
+    Args:
+        video_path (str): The path of the video file.
+        scene_frames (list): (time, JPEG bytes or None) pairs in time order, see
+            `SceneExtractor.SceneThumbnails.select`.
+        picture_format (str, optional): The format of fetched pictures. Defaults to 'jpeg'.
+        encode_workers (int, optional): The number of encoding threads. Defaults to 1.
+
+    Returns:
+        list: One io.BytesIO per scene frame, None where the frame could not be read.
+    """
+    missing = [t for t, jpeg in scene_frames if jpeg is None]
+    fetched = iter(encode_pictures(video_path, missing, picture_format, encode_workers))
+    return [
+        BytesIO(jpeg) if jpeg is not None else next(fetched) for _, jpeg in scene_frames
+    ]
+
+
+def add_frame_to_docx(picture, para):
+    """
+    Adds a video frame to a docx file.
+
+    Args:
+        picture (io.BytesIO): The encoded frame, see `encode_picture`. None skips the picture.
+        para (docx.text.paragraph.Paragraph): The paragraph to which the frame will be added.
+
+    Returns:
+        docx.text.paragraph.Paragraph: The original Paragraph object with the added frame.
+    """
+    if picture is None:
+        logger.debug("Failed to retrieve frame")
+        return para
 
     # Add the frame to the docx file
     run = para.add_run("\n\n")
-    run.add_picture(frame_file, width=Cm(15))
+    run.add_picture(picture, width=Cm(PICTURE_WIDTH_CM))
     return para  # Return the original Paragraph object
 
 
-def write_docx(content, should_execute, picture_execute, output_file, video_path):
+def plan_pictures(
+    video_path,
+    picture_execute,
+    timeline,
+    picture_format="jpeg",
+    encode_workers=1,
+    thumbnails=None,
+):
     """
-    Executes an action (writing to a Word document) for each item in the content where should_execute is True.
+    Fetches the pictures of a document, keyed by caption index.
 
     Args:
-        content (list): A list of tuples containing the text, URL, start time, and end time.
-        should_execute (list): A list of booleans indicating whether an action should be executed for each item in the content.
-        output_file (str): The path and filename of the output Word document.
+        video_path (str): The path of the video file.
+        picture_execute (list): Booleans marking the captions that get a picture.
+        timeline (CaptionTimeline): The timeline of the content.
+        picture_format (str, optional): 'jpeg' or 'png'. Defaults to 'jpeg'.
+        encode_workers (int, optional): Threads encoding the frames. Defaults to 1.
+        thumbnails (SceneThumbnails, optional): Scene change frames kept by scene detection,
+            one per picture in order (see `determine_execution_from_scene`). Pictures are
+            taken from it instead of decoding the video again; missing ones are fetched.
 
     Returns:
-        None
+        dict: Caption index to io.BytesIO, or None where the frame could not be read.
     """
-    cap = cv2.VideoCapture(video_path)
-    doc = Document()
-    para = doc.add_paragraph()  # Create a paragraph outside the loop
-    start_time = parse_time(content[0][2])  # Parse the start time
-    end_code = parse_time(content[0][3]).time()
-    for (text, url, start, end), execute, pic_execute in zip(
-        content, should_execute, picture_execute
+    picture_indices = np.flatnonzero(np.asarray(picture_execute, dtype=bool))
+    if thumbnails is not None and len(thumbnails.scene_frames) == len(picture_indices):
+        pictures = scene_pictures(
+            video_path, thumbnails.scene_frames, picture_format, encode_workers
+        )
+    else:
+        pictures = encode_pictures(
+            video_path,
+            timeline.starts_ms[picture_indices] / 1000,
+            picture_format,
+            encode_workers,
+        )
+    return dict(zip(picture_indices, pictures))
+
+
+def iter_document_plan(content, should_execute, picture_execute, timeline):
+    """
+    Yields the layout of a transcript document, shared by all writer backends.
+
+    Items are ("time_range", start_ms, end_ms) closing a paragraph, ("paragraph_break",)
+    between paragraphs, ("picture", caption_index) and ("caption", caption_index, text, url).
+    """
+    starts_ms, ends_ms = timeline.starts_ms, timeline.ends_ms
+    start_ms = starts_ms[0]
+    for i, ((text, url, _, _), execute, pic_execute) in enumerate(
+        zip(content, should_execute, picture_execute)
     ):
-        current_time = parse_time(start)
         if execute:
-            para.add_run("\n")  # Insert a paragraph break
-            start_code = start_time.time()
-            start_code = start_code.strftime("%H:%M:%S")
+            # The paragraph ends where the previous caption ended
+            yield "time_range", start_ms, ends_ms[max(i - 1, 0)]
+            yield ("paragraph_break",)
+            start_ms = starts_ms[i]
+        if pic_execute:
+            yield "picture", i
+        yield "caption", i, text, url
+    yield "time_range", start_ms, ends_ms[-1]
+
+
+def format_time_range(start_ms, end_ms):
+    return f"({format_clock(start_ms)} - {format_clock(end_ms)}) \n"
 
-            end_code = end_code.strftime("%H:%M:%S")
-            para.add_run(f"({start_code} - {end_code}) \n")
+
+def _write_docx_python_docx(plan, pictures, output_file, header=None):
+    doc = Document()
+    if header:
+        doc.add_paragraph(header)
+    para = doc.add_paragraph()  # Create a paragraph outside the loop
+    for kind, *values in plan:
+        if kind == "time_range":
+            para.add_run("\n")  # Insert a paragraph break
+            para.add_run(format_time_range(*values))
+        elif kind == "paragraph_break":
             para.add_run("\n\n")  # Insert a paragraph break
-            start_time = current_time
-        if pic_execute:
-            para = add_frame_to_docx(cap, current_time, para)
-        run = para.add_run(text + " ")
-        add_hyperlink(run, url, text)
-        end_code = parse_time(end)
-
-    para.add_run("\n")  # Insert a paragraph break
-    para.add_run(
-        f"({start_time.time().strftime('%H:%M:%S')} - {parse_time(content[-1][3]).strftime('%H:%M:%S')}) \n"
-    )
+        elif kind == "picture":
+            para = add_frame_to_docx(pictures[values[0]], para)
+        else:
+            _, text, url = values
+            run = para.add_run(text + " ")
+            add_hyperlink(run, url, text)
     doc.save(output_file)
-    cap.release()
-    logger.info(f"Word file {output_file} created successfully")
 
 
-def parse_time(time_str):
+def _write_docx_stream(plan, pictures, output_file, header=None):
+    with DocxStreamWriter(output_file) as writer:
+        if header:
+            writer.add_paragraph(header)
+        writer.add_paragraph()
+        for kind, *values in plan:
+            if kind == "time_range":
+                writer.add_text("\n")
+                writer.add_text(format_time_range(*values))
+            elif kind == "paragraph_break":
+                writer.add_text("\n\n")
+            elif kind == "picture":
+                picture = pictures[values[0]]
+                if picture is None:
+                    logger.debug("Failed to retrieve frame")
+                    continue
+                writer.add_text("\n\n")
+                writer.add_picture(picture.getvalue(), PICTURE_WIDTH_CM)
+            else:
+                _, text, url = values
+                writer.add_hyperlink(text, url)
+
+
+DOCX_BACKENDS = {
+    "stream": _write_docx_stream,
+    "python-docx": _write_docx_python_docx,
+}
+
+
+def write_docx(
+    content,
+    should_execute,
+    picture_execute,
+    output_file,
+    video_path,
+    timeline=None,
+    picture_format="jpeg",
+    encode_workers=1,
+    thumbnails=None,
+    backend="stream",
+    header=None,
+):
     """
-    Parses a time string and returns a datetime object.
+    Executes an action (writing to a Word document) for each item in the content where should_execute is True.
 
     Args:
-        time_str (str): The time string to parse. It should be in the format "HH:MM:SS.sss" or "MM:SS.sss".
+        content (list): A list of tuples containing the text, URL, start time, and end time.
+        should_execute (list): A list of booleans indicating whether an action should be executed for each item in the content.
+        output_file (str): The path and filename of the output Word document.
+        timeline (CaptionTimeline, optional): The timeline of the content, built from it when omitted.
+        picture_format (str, optional): 'jpeg' or 'png' for the embedded frames. Defaults to 'jpeg'.
+        encode_workers (int, optional): Threads encoding the embedded frames. Defaults to 1.
+        thumbnails (SceneThumbnails, optional): Scene change frames kept by scene detection, see `plan_pictures`.
+        backend (str, optional): 'stream' writes document.xml straight into the zip (see
+            `docx_stream.DocxStreamWriter`), 'python-docx' builds the document tree. Defaults to 'stream'.
+        header (str, optional): A paragraph written above the transcript, such as the LLM summary.
 
     Returns:
-        datetime: A datetime object representing the parsed time.
+        None
+    """
+    if backend not in DOCX_BACKENDS:
+        raise ValueError(f"Invalid docx backend: {backend}")
+    if timeline is None:
+        timeline = CaptionTimeline.from_content(content)
+    pictures = plan_pictures(
+        video_path, picture_execute, timeline, picture_format, encode_workers, thumbnails
+    )
+    plan = iter_document_plan(content, should_execute, picture_execute, timeline)
+    DOCX_BACKENDS[backend](plan, pictures, output_file, header)
+    logger.info(f"Word file {output_file} created successfully")
+
+
+def _picture_type(picture):
+    """Returns the file extension and MIME type of an encoded picture."""
+    if picture.getvalue()[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png", "image/png"
+    return "jpg", "image/jpeg"
 
-    Raises:
-        ValueError: If the time string is not in a valid format.
 
+def _save_picture_files(pictures, output_file):
     """
-    # Handle two types of time formats: "HH:MM:SS.sss" and "MM:SS.sss"
-    if len(time_str.split(":")) == 3:
-        time = datetime.strptime(time_str, "%H:%M:%S.%f")
-    else:
-        time = datetime.strptime(time_str, "%M:%S.%f")
-    time = time.replace(year=1970)
-    return time
+    Saves the pictures of a text transcript next to it, in '<name>_files'.
+
+    Returns:
+        dict: Caption index to the picture path relative to the transcript.
+    """
+    stem = os.path.splitext(os.path.basename(output_file))[0]
+    directory = f"{stem}_files"
+    paths = {}
+    for i, picture in pictures.items():
+        if picture is None:
+            continue
+        if not paths:
+            os.makedirs(os.path.join(os.path.dirname(output_file), directory), exist_ok=True)
+        paths[i] = f"{directory}/frame_{i}.{_picture_type(picture)[0]}"
+        with open(os.path.join(os.path.dirname(output_file), paths[i]), "wb") as f:
+            f.write(picture.getvalue())
+    return paths
+
+
+def _markdown_link_text(text):
+    return re.sub(r"([\\\[\]*_`<>#])", r"\\\1", " ".join(text.split()))
+
+
+def _write_markdown(plan, pictures, output_file, timeline, header=None):
+    picture_paths = _save_picture_files(pictures, output_file)
+    with open(output_file, "w", encoding="utf-8") as f:
+        if header:
+            f.write("".join(f"> {line}\n" for line in header.splitlines()) + "\n")
+        for kind, *values in plan:
+            if kind == "time_range":
+                f.write(f"\n\n*{format_time_range(*values).strip()}*")
+            elif kind == "paragraph_break":
+                f.write("\n\n")
+            elif kind == "picture":
+                if values[0] in picture_paths:
+                    f.write(f"![frame {values[0]}]({picture_paths[values[0]]})\n\n")
+            else:
+                _, text, url = values
+                url = url.replace("(", "%28").replace(")", "%29")
+                f.write(f"[{_markdown_link_text(text)}]({url}) ")
+        f.write("\n")
+
+
+HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ max-width: 50em; margin: 2em auto; font-family: sans-serif; line-height: 1.6; }}
+a {{ color: inherit; text-decoration: none; }}
+a:hover {{ text-decoration: underline; }}
+img {{ display: block; width: 100%; height: auto; margin: 1em 0; }}
+.time {{ color: #777; font-size: 0.9em; }}
+.header {{ white-space: pre-wrap; border-bottom: 1px solid #ccc; padding-bottom: 1em; }}
+</style>
+</head>
+<body>
+"""
+
+
+def _write_html(plan, pictures, output_file, timeline, header=None):
+    title = os.path.splitext(os.path.basename(output_file))[0]
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(HTML_HEAD.format(title=html.escape(title)))
+        if header:
+            f.write(f'<div class="header">{html.escape(header)}</div>\n')
+        f.write("<p>")
+        for kind, *values in plan:
+            if kind == "time_range":
+                f.write(f'</p>\n<p class="time">{format_time_range(*values).strip()}</p>\n')
+            elif kind == "paragraph_break":
+                f.write("<p>")
+            elif kind == "picture":
+                picture = pictures[values[0]]
+                if picture is None:
+                    continue
+                # Inline data keeps the file self-contained; loading="lazy" would do
+                # nothing here, as the bytes are already part of the page
+                data = base64.b64encode(picture.getvalue()).decode("ascii")
+                f.write(
+                    f'<img decoding="async" alt="frame {values[0]}" '
+                    f'src="data:{_picture_type(picture)[1]};base64,{data}">'
+                )
+            else:
+                _, text, url = values
+                f.write(f'<a href="{html.escape(url)}">{html.escape(text)}</a> ')
+        f.write("</body>\n</html>\n")
+
+
+def _write_jsonl(plan, pictures, output_file, timeline, header=None):
+    picture_paths = _save_picture_files(pictures, output_file)
+    starts_ms, ends_ms = timeline.starts_ms, timeline.ends_ms
+    paragraph = 0
+    with open(output_file, "w", encoding="utf-8") as f:
+
+        def write(record):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        if header:
+            write({"type": "header", "text": header})
+        for kind, *values in plan:
+            if kind == "time_range":
+                start_ms, end_ms = values
+                write(
+                    {
+                        "type": "paragraph",
+                        "paragraph": paragraph,
+                        "start": int(start_ms) / 1000,
+                        "end": int(end_ms) / 1000,
+                    }
+                )
+            elif kind == "paragraph_break":
+                paragraph += 1
+            elif kind == "picture":
+                if values[0] in picture_paths:
+                    write(
+                        {
+                            "type": "picture",
+                            "paragraph": paragraph,
+                            "start": int(starts_ms[values[0]]) / 1000,
+                            "path": picture_paths[values[0]],
+                        }
+                    )
+            else:
+                i, text, url = values
+                write(
+                    {
+                        "type": "caption",
+                        "paragraph": paragraph,
+                        "start": int(starts_ms[i]) / 1000,
+                        "end": int(ends_ms[i]) / 1000,
+                        "text": text,
+                        "url": url,
+                    }
+                )
+
+
+TEXT_WRITERS = {
+    "markdown": _write_markdown,
+    "html": _write_html,
+    "jsonl": _write_jsonl,
+}
+
+
+def write_transcript(
+    content,
+    should_execute,
+    picture_execute,
+    output_file,
+    video_path,
+    format,
+    timeline=None,
+    picture_format="jpeg",
+    encode_workers=1,
+    thumbnails=None,
+    header=None,
+):
+    """
+    Writes the transcript as Markdown, single-file HTML or JSON Lines.
+
+    The writers stream the same paragraph and picture plan as `write_docx` straight to
+    the file, with every caption linking to its `&t=` position in the video. Markdown
+    and JSON Lines keep their pictures in a '<name>_files' folder next to the file; HTML
+    inlines them as data URIs, decoded off the main thread, so the page stays a single
+    file. The inline bytes arrive with the page, so there is nothing to load lazily.
+
+    Args:
+        content (list): A list of tuples containing the text, URL, start time, and end time.
+        should_execute (list): Booleans marking the captions that start a new paragraph.
+        picture_execute (list): Booleans marking the captions that get a picture.
+        output_file (str): The path of the output file.
+        video_path (str): The path of the video file the pictures are taken from.
+        format (str): 'markdown', 'html' or 'jsonl'.
+        Other arguments are the same as for `write_docx`.
+
+    Returns:
+        None
+    """
+    if format not in TEXT_WRITERS:
+        raise ValueError(f"Invalid format: {format}")
+    if timeline is None:
+        timeline = CaptionTimeline.from_content(content)
+    pictures = plan_pictures(
+        video_path, picture_execute, timeline, picture_format, encode_workers, thumbnails
+    )
+    plan = iter_document_plan(content, should_execute, picture_execute, timeline)
+    TEXT_WRITERS[format](plan, pictures, output_file, timeline, header)
+    logger.info(f"{format} file {output_file} created successfully")
 
 
 def generate_content(vtt_file, link, format):
@@ -355,7 +876,16 @@ def generate_content(vtt_file, link, format):
     return content
 
 
-def vtt_to_file(vtt_file, output_file, link, video_path, format,pic_embed):
+def vtt_to_file(
+    vtt_file,
+    output_file,
+    link,
+    video_path,
+    format,
+    pic_embed,
+    header=None,
+    scene_shards=1,
+):
     """
     Convert a VTT file to a specified format and write the content to an output file.
 
@@ -363,7 +893,12 @@ def vtt_to_file(vtt_file, output_file, link, video_path, format,pic_embed):
     vtt_file (str): The path to the VTT file.
     output_file (str): The path to the output file.
     link (str): The link of the video.
-    format (str): The desired format of the output file. Currently supports 'word'.
+    format (str): The desired format of the output file, one of TRANSCRIPT_FORMATS
+        ('docx', 'markdown', 'html', 'jsonl').
+    header (str, optional): A paragraph written above the transcript, so a summary that is
+        ready before the transcript is written needs no second pass over the file.
+    scene_shards (int, optional): Processes scene detection splits the video across.
+        Defaults to 1.
 
     Raises:
     ValueError: If an invalid format is provided.
@@ -371,33 +906,153 @@ def vtt_to_file(vtt_file, output_file, link, video_path, format,pic_embed):
     Returns:
     None
     """
+    if format not in TRANSCRIPT_FORMATS:
+        raise ValueError("Invalid format")
     logger.info(f"generating content")
     # Generate the content
     content = generate_content(vtt_file, link, format)
+    timeline = CaptionTimeline.from_content(content)
 
     # Write the content to the output file
-    if format == "docx":
-        # should_execute = should_execute_action(video_path, content, mode='scene', minutes_per_paragraph=0.5, alpha=1.0)
-
-        if pic_embed == 'True':
-            logger.info(f"determine_execution_from_scene")
-            should_execute_scene = determine_execution_from_scene(
-                video_path, content, alpha=1, frame_per_minute=0
-            )
-            picture_execute = should_execute_scene
-        else:
-            should_execute_scene = basic_execute_pattern(content)
-            picture_execute =  basic_execute_pattern(content)
-        should_execute = determine_execution_from_boolean_list(
-            should_execute_scene, content
+    # should_execute = should_execute_action(video_path, content, mode='scene', minutes_per_paragraph=0.5, alpha=1.0)
+
+    thumbnails = None
+    if pic_embed == 'True':
+        # Imported here so text-only jobs never load torch
+        from SceneExtractor import SceneThumbnails
+
+        logger.info(f"determine_execution_from_scene")
+        thumbnails = SceneThumbnails()
+        should_execute_scene = determine_execution_from_scene(
+            video_path,
+            timeline,
+            alpha=1,
+            frame_per_minute=0,
+            thumbnails=thumbnails,
+            shards=scene_shards,
         )
-        logger.debug(f"should_execute:{should_execute}")
+        picture_execute = should_execute_scene
+    else:
+        should_execute_scene = basic_execute_pattern(timeline)
+        picture_execute = basic_execute_pattern(timeline)
+    should_execute = determine_execution_from_boolean_list(
+        should_execute_scene, timeline
+    )
+    logger.debug(f"should_execute:{should_execute}")
 
+    if format == "docx":
         logger.info(f"write_docx")
         write_docx(
-            content, should_execute, picture_execute, output_file, video_path=video_path
+            content,
+            should_execute,
+            picture_execute,
+            output_file,
+            video_path=video_path,
+            timeline=timeline,
+            thumbnails=thumbnails,
+            header=header,
         )
-        logger.debug(f"close_vtt_to_file")
-
     else:
-        raise ValueError("Invalid format")
+        logger.info(f"write_transcript")
+        write_transcript(
+            content,
+            should_execute,
+            picture_execute,
+            output_file,
+            video_path,
+            format,
+            timeline=timeline,
+            thumbnails=thumbnails,
+            header=header,
+        )
+    logger.debug(f"close_vtt_to_file")
+
+
+def _write_benchmark_vtt(vtt_file, captions):
+    with open(vtt_file, "w", encoding="utf-8") as f:
+        f.write("WEBVTT\n\n")
+        for i in range(captions):
+            start, end = i * 2500, i * 2500 + 2400
+            f.write(
+                f"{format_clock(start)}.{start % 1000:03d} --> "
+                f"{format_clock(end)}.{end % 1000:03d}\n"
+                f"caption {i} of the benchmark transcript\n\n"
+            )
+
+
+def benchmark_docx_backends(
+    vtt_file=None,
+    captions=10000,
+    link="https://www.youtube.com/watch?v=benchmark",
+    backends=tuple(DOCX_BACKENDS),
+):
+    """
+    Times the docx writer backends on a transcript without pictures.
+
+    Args:
+        vtt_file (str, optional): The VTT file to convert. Defaults to a generated
+            transcript with `captions` captions, 2.5 seconds each.
+        captions (int, optional): The size of the generated transcript. Defaults to 10000.
+        link (str, optional): The video link the hyperlinks point to.
+        backends (tuple, optional): The backends to time, see `DOCX_BACKENDS`; the first
+            one is the reference for the speedup.
+
+    Returns:
+        list: One dict per backend with name, seconds, bytes and speedup.
+    """
+    report = []
+    with tempfile.TemporaryDirectory() as directory:
+        if vtt_file is None:
+            vtt_file = os.path.join(directory, "benchmark.vtt")
+            _write_benchmark_vtt(vtt_file, captions)
+        content = generate_content(vtt_file, link, "docx")
+        timeline = CaptionTimeline.from_content(content)
+        no_pictures = basic_execute_pattern(timeline)
+        should_execute = determine_execution_from_boolean_list(no_pictures, timeline)
+        for backend in backends:
+            output_file = os.path.join(directory, f"{backend}.docx")
+            start = time.perf_counter()
+            write_docx(
+                content,
+                should_execute,
+                no_pictures,
+                output_file,
+                None,
+                timeline,
+                backend=backend,
+            )
+            seconds = time.perf_counter() - start
+            report.append(
+                {
+                    "name": backend,
+                    "seconds": seconds,
+                    "bytes": os.path.getsize(output_file),
+                    "speedup": report[0]["seconds"] / seconds if report else 1.0,
+                }
+            )
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the docx writer backends")
+    parser.add_argument("--vtt", type=str, default=None, help="VTT file to convert")
+    parser.add_argument(
+        "--captions", type=int, default=10000, help="captions of the generated VTT"
+    )
+    parser.add_argument(
+        "--backends",
+        type=str,
+        nargs="+",
+        default=["python-docx", "stream"],
+        help="backends to compare, the first one is the reference",
+    )
+    args = parser.parse_args()
+
+    rows = benchmark_docx_backends(args.vtt, args.captions, backends=tuple(args.backends))
+    print(f"{'backend':<14}{'seconds':>9}{'bytes':>11}{'speedup':>9}")
+    for row in rows:
+        print(
+            f"{row['name']:<14}{row['seconds']:>9.2f}{row['bytes']:>11}{row['speedup']:>9.2f}"
+        )
@@ -1,10 +1,7 @@
 import unicodedata
-from docx import Document
 from tqdm import tqdm
 import json
 import os
-import tempfile
-import subprocess
 import argparse
 from urllib.parse import urlparse
 import xml.etree.ElementTree as ET
@@ -14,10 +11,10 @@ import sys
 import chardet
 import re
 import requests
-import glob
-from STT_module import audio_language, faster_whisper_transcribe_vtt
+from STT_module import audio_language, faster_whisper_transcribe_vtt, is_partial_vtt
 from TTS_module import generate_audio_openvoice
-from vtt_to_doc import vtt_to_file
+from vtt_to_doc import TRANSCRIPT_FORMATS, vtt_to_file
+from video_source import get_driver, match_language, metadata_language
 from logger import logger
 from auxiliary_function import chunk_string_by_words
 import webvtt
@@ -157,44 +154,11 @@ def summary_video_from_link(
         None
     """
 
-    def find_video_file(directory, pure_filename):
-        """
-        Finds the video file in the specified directory with the specified filename (without extension).
-
-        Args:
-            directory (str): The directory where the files are located.
-            pure_filename (str): The filename without extension.
-
-        Returns:
-            str: The filename with extension of the video file, or None if no video file is found.
-        """
-        # Define the video file extensions
-        video_extensions = [
-            ".webm",
-            ".mp4",
-            ".avi",
-            ".mov",
-            ".mkv",
-            ".flv",
-            ".wmv",
-            ".m4a",
-        ]
-
-        # Search for the video file
-        all_files = glob.glob(os.path.join(directory, f"*{pure_filename}*"))
-
-        for file in all_files:
-            filename, extension = os.path.splitext(file)
-            if extension in video_extensions and not re.search(r"\.f\d{3}", filename):
-                # Return the video file found
-                return glob.glob(os.path.join(directory, os.path.basename(file)))[0]
-        logger.error("did not donwload video yet")
-
     def download_subtitle_file(
-        audiopath, pure_filename, video_language, text_output_dir
+        downloads, pure_filename, subtitle_language, text_output_dir
     ):
-        vtt_file = os.path.join(audiopath, f"{pure_filename}.{video_language}.vtt")
-        if os.path.exists(vtt_file):
+        vtt_file = downloads["subtitles"].get(subtitle_language)
+        if vtt_file and os.path.exists(vtt_file):
             if not os.path.exists(os.path.join(text_output_dir, f"{pure_filename}.vtt")):
                 os.rename(
                     vtt_file,
@@ -202,64 +166,53 @@ def summary_video_from_link(
                 )
 
         vtt_file = os.path.join(text_output_dir, f"{pure_filename}.vtt")
-        if not os.path.exists(vtt_file):
+        # An interrupted transcription is resumed where it stopped
+        if not os.path.exists(vtt_file) or is_partial_vtt(vtt_file):
             faster_whisper_transcribe_vtt(
-                f"{os.path.join(audiopath, pure_filename)}.mp3",
+                downloads["audio"],
                 args.whisper_model_size,
                 vtt_file,
+                workers=args.stt_workers,
+                batch_size=args.stt_batch_size,
             )
 
         logger.info(f"subtitle is stored:{vtt_file}")
 
-    def get_audio_filename(link):
-        # Create a temporary directory using the context manager
-        with tempfile.TemporaryDirectory() as temp_dir:
-            get_dl_audio_path_cmd = f'yt-dlp {link} -o "{temp_dir}/%(title)s.%(ext)s" -S "+size,+br" --extract-audio --audio-format mp3 --no-keep-video --quiet'
-            # Run the command without specifying the encoding
-            subprocess.run(
-                get_dl_audio_path_cmd, shell=True, universal_newlines=True
-            )
-            file = os.listdir(temp_dir)
-            # Get the filename without extension
-            pure_filename = os.path.splitext(os.path.basename(file[0]))[0]
-        # Normalize the filename
-        # pure_filename = unicodedata.normalize("NFKD", pure_filename)
-        return pure_filename
-
-    def get_video_lang(link, pure_filename):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            download_video_cmd = f'yt-dlp {link} -o "{temp_dir}/%(title)s.%(ext)s" -S "+size,+br" --download-sections "*01:00-01:30" --extract-audio --audio-format mp3 --no-keep-video'
-            subprocess.run(download_video_cmd, shell=True)
-            sample_audio_path = os.path.join(temp_dir, f"{pure_filename}.mp3")
-            video_language = audio_language(sample_audio_path)
-        return video_language
-
     logger.info(f"processing {link}")
-    pure_filename = get_audio_filename(link)
+    # One yt-dlp driver per process; the download below reuses the probed metadata
+    driver = get_driver(audiopath)
+    metadata = driver.probe(link)
+    pure_filename = metadata["filename"]
     logger.info(f"video name:{pure_filename}")
-    video_language = get_video_lang(link, pure_filename)
-    logger.info(f"video language:{video_language}")
+    video_language = metadata_language(metadata)
     if args.pic_embed == "True":
-        res_option = ''
+        format_sort = ()
     if args.pic_embed == "False":
-        res_option = '-S "+size,+br"'
+        format_sort = ("+size", "+br")
 
-    download_video_cmd = f'yt-dlp {link} -o "{audiopath}/%(title)s.%(ext)s" {res_option} --extract-audio --audio-format mp3 --keep-video --write-subs  --sub-format vtt --sub-langs {video_language}'
-    subprocess.run(download_video_cmd, shell=True)
+    subtitle_language = match_language(video_language, metadata["subtitles"])
+    if video_language is None:
+        # Unknown language: fetch every uploaded subtitle, they are small. The probe
+        # already left out chat replays, which are neither small nor VTT
+        subtitle_languages = metadata["subtitles"]
+    else:
+        subtitle_languages = [subtitle_language] if subtitle_language else []
+    downloads = driver.download(
+        metadata, format_sort=format_sort, subtitle_languages=subtitle_languages
+    )
+    if video_language is None:
+        # Detect it on the audio just downloaded, with the model that will transcribe it
+        video_language = audio_language(
+            downloads["audio"], model_size=args.whisper_model_size
+        )
+        subtitle_language = match_language(video_language, downloads["subtitles"])
+    logger.info(f"video language:{video_language}")
 
-    download_subtitle_file(audiopath, pure_filename, video_language, text_output_dir)
+    download_subtitle_file(downloads, pure_filename, subtitle_language, text_output_dir)
     # llm
     vtt_file = os.path.join(text_output_dir, f"{pure_filename}.vtt")
 
-    video_path = find_video_file(directory=audiopath, pure_filename=pure_filename)
-    vtt_to_file(
-        vtt_file=vtt_file,
-        output_file=os.path.join(integrate_text_output_dir, f"{pure_filename}.docx"),
-        link=link,
-        video_path=video_path,
-        format="docx",
-        pic_embed=args.pic_embed,
-    )
+    video_path = downloads["video"]
 
     if args.timestamp_content == "True":
         with open(vtt_file, "r", encoding="utf-8") as fp:
@@ -268,9 +221,26 @@ def summary_video_from_link(
         file_content = clean_vtt(vtt_file)
 
     chunks = chunk_string_by_words(file_content, 6000)
-    response_text = llm_summary(
-        args, link, integrate_text_output_dir, pure_filename, chunks
-    )
+    response_text = None
+    try:
+        response_text = llm_summary(args, chunks)
+    finally:
+        # The document is assembled once, with the LLM header if the summary succeeded
+        vtt_to_file(
+            vtt_file=vtt_file,
+            output_file=os.path.join(
+                integrate_text_output_dir,
+                pure_filename + TRANSCRIPT_FORMATS[args.output_format],
+            ),
+            link=link,
+            video_path=video_path,
+            format=args.output_format,
+            pic_embed=args.pic_embed,
+            header=None
+            if response_text is None
+            else llm_header_text(pure_filename, link, args, response_text),
+            scene_shards=args.scene_shards,
+        )
     if args.TTS_create == "True":
         generate_audio_openvoice(
             response_text, post_audio_output_dir,pure_filename, args.language
@@ -278,34 +248,26 @@ def summary_video_from_link(
         # generate_audio_coqui(response_text, post_audio_output_dir,pure_filename, args.language)
 
 
-def llm_summary(args, link, integrate_text_output_dir, pure_filename, chunks):
-    def integrate_text_format(
-        video_title, link, args, integrate_text_output_dir, llm_content
-    ):
-        integrate_text = (
-            video_title
-            + "\n("
-            + link
-            + ")\n"
-            + "#" * 16
-            + "\n"
-            + "prompt:"
-            + args.prompt
-            + "\n"
-            + llm_content
-            + "\n"
-            + "#" * 16
-            + "\n"
-        )
-        file_name = os.path.join(integrate_text_output_dir, f"{video_title}.docx")
-
-        doc = Document(file_name)
+def llm_header_text(video_title, link, args, llm_content):
+    """Formats the LLM response as the header paragraph of the transcript document."""
+    return (
+        video_title
+        + "\n("
+        + link
+        + ")\n"
+        + "#" * 16
+        + "\n"
+        + "prompt:"
+        + args.prompt
+        + "\n"
+        + llm_content
+        + "\n"
+        + "#" * 16
+        + "\n"
+    )
 
-        new_para = doc.paragraphs[0].insert_paragraph_before(integrate_text)
-        # 保存文件
-        doc.save(file_name)
-        return None
 
+def llm_summary(args, chunks):
     if args.model_name == "auto":
         if args.language == "zh":
             model_name = "ycchen/breeze-7b-instruct-v1_0"
@@ -358,9 +320,6 @@ def llm_summary(args, link, integrate_text_output_dir, pure_filename, chunks):
     if args.llm_format == 'both':
         response_text = integrate_response_text + "\n =========== \n" + combined_responses
 
-    integrate_text_format(
-        pure_filename, link, args, integrate_text_output_dir, response_text
-    )
     logger.info(f"LLM response character count: {len(response_text)}")
     return response_text
 
@@ -415,6 +374,31 @@ def parse_arguments():
     parser.add_argument(
         "--llm_format", type=str, default="detail", help="LLM output format"
     )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="docx",
+        choices=list(TRANSCRIPT_FORMATS),
+        help="transcript file format",
+    )
+    parser.add_argument(
+        "--stt_workers",
+        type=int,
+        default=1,
+        help="processes transcribing a long audio file in parallel",
+    )
+    parser.add_argument(
+        "--stt_batch_size",
+        type=int,
+        default=0,
+        help="audio chunks whisper decodes per call, 0 decodes them one after the other",
+    )
+    parser.add_argument(
+        "--scene_shards",
+        type=int,
+        default=1,
+        help="processes scene detection splits a video across",
+    )
 
     return parser.parse_args()
 